@@ -0,0 +1,266 @@
+'''
+KylttiMaker benchmark
+
+Generates synthetic spreadsheets and runs the headless generation pipeline on
+them with QR, text and hole heavy sign configurations for every DXF version.
+Each case runs in a fresh process and records signs per second, peak memory,
+the time spent reading, laying out, drawing and saving, and the output size.
+Results can be saved as JSON and compared with an earlier run.
+
+Usage: python benchmark.py --rows 1000 10000 -o results.json --compare old.json
+'''
+
+import argparse
+import json
+import multiprocessing
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+import ezdxf
+import numpy as np
+from engine import DXF_VERSIONS, Column, FieldSpec, HoleSpec, Job, Layout, MarkSpec, QRSpec, TextSpec, render_sheet
+from dxfwriter import DirectSheet
+from spreadsheet import WORKBOOKS, read_column
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+# Marks drawn for every value in each configuration.
+CONFIGS: Dict[str, Tuple[MarkSpec, ...]] = {
+    'QR': (QRSpec(position_x=1.0, position_y=1.0, size=20.0),),
+    'TEXT': (
+        TextSpec(position_x=75.0, position_y=6.0, size=5.0),
+        TextSpec(position_x=75.0, position_y=16.0, size=5.0),
+        TextSpec(position_x=2.0, position_y=11.0, size=3.0, align='MIDDLE_LEFT')
+    ),
+    'HOLE': (
+        HoleSpec(position_x=5.0, position_y=11.0, diameter=4.0),
+        HoleSpec(position_x=145.0, position_y=11.0, diameter=4.0),
+        HoleSpec(position_x=40.0, position_y=11.0, diameter=2.0),
+        HoleSpec(position_x=110.0, position_y=11.0, diameter=2.0)
+    )
+}
+VALUE_OPTIONS = ('short', 'long')
+
+
+# A single benchmark run.
+@dataclass(frozen=True)
+class Case:
+    config: str
+    rows: int
+    values: str
+    dxf_version: str
+    backend: str = 'EZDXF'
+    layers_per_sheet: int = 10
+
+    # Key used to match the case between result files.
+    @property
+    def key(self) -> Tuple[Any, ...]:
+        return (self.config, self.rows, self.values, self.dxf_version, self.backend, self.layers_per_sheet)
+
+
+# Value of a synthetic row. Long values make bigger QR codes and longer texts.
+def synthetic_value(row: int, values: str) -> str:
+    if values == 'long':
+        return f'KYLTTI-{row:08d}-' + 'ABCDEFGHIJ' * 5
+    return f'S{row:06d}'
+
+
+# Write an .xlsx file with the given number of synthetic values in its first column.
+def write_spreadsheet(path: Path, rows: int, values: str) -> None:
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as package:
+        package.writestr('[Content_Types].xml', '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                         '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                         '</Types>')
+        package.writestr('_rels/.rels', '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+                         '</Relationships>')
+        package.writestr('xl/workbook.xml', '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                         '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>')
+        package.writestr('xl/_rels/workbook.xml.rels', '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+                         '</Relationships>')
+        with package.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            for row in range(rows):
+                value = escape(synthetic_value(row, values))
+                sheet.write(f'<row r="{row + 1}"><c r="A{row + 1}" t="inlineStr"><is><t>{value}</t></is></c></row>'.encode())
+            sheet.write(b'</sheetData></worksheet>')
+
+
+# Path of the synthetic spreadsheet of the given size, written only if it doesn't exist yet.
+def spreadsheet_path(directory: Path, rows: int, values: str) -> Path:
+    path = directory / f'benchmark_{rows}_{values}.xlsx'
+    if not path.exists():
+        write_spreadsheet(path, rows, values)
+    return path
+
+
+# Peak memory use of the current process in megabytes, None if it can't be measured.
+def peak_memory() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+# Run the pipeline of a single case and return its measurements. Called in a fresh worker process.
+def run_case(case: Case, data_path: Path, output_directory: Path) -> Dict[str, Any]:
+    seconds = {}
+    start = time.perf_counter()
+    WORKBOOKS.clear()
+    values = read_column(data_path, 1, disk_cache=False)
+    seconds['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    job = Job(Layout(layers_per_sheet=case.layers_per_sheet), (FieldSpec(Column(values), CONFIGS[case.config]),),
+              case.dxf_version, backend=case.backend)
+    total_sheets = job.total_sheets
+    seconds['layout'] = time.perf_counter() - start
+
+    seconds['draw'] = seconds['save'] = 0.0
+    output_bytes = 0
+    path = output_directory / 'sheet.dxf'
+    for sheet_index in range(total_sheets):
+        start = time.perf_counter()
+        sheet = render_sheet(job, sheet_index)
+        seconds['draw'] += time.perf_counter() - start
+        start = time.perf_counter()
+        sheet.saveas(path)
+        if isinstance(sheet, DirectSheet):
+            sheet.close()
+        seconds['save'] += time.perf_counter() - start
+        output_bytes += path.stat().st_size
+        path.unlink()
+        del sheet
+
+    seconds['total'] = sum(seconds.values())
+    return {
+        **asdict(case),
+        'signs': job.total_signs,
+        'sheets': total_sheets,
+        'seconds': seconds,
+        'signs_per_second': job.total_signs / seconds['total'],
+        'peak_memory_mb': peak_memory(),
+        'output_bytes': output_bytes
+    }
+
+
+# Run a case in its own process so that caches and peak memory don't carry over between cases.
+def run_isolated(case: Case, data_path: Path, output_directory: Path) -> Dict[str, Any]:
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_case, case, data_path, output_directory).result()
+
+
+# Versions and environment the results were measured with.
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).parent,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'ezdxf': ezdxf.__version__,
+        'numpy': np.__version__
+    }
+
+
+def describe(result: Dict[str, Any]) -> str:
+    seconds = result['seconds']
+    memory = result['peak_memory_mb']
+    return (f'{result["config"]:<5} {result["rows"]:>7} {result["values"]:<5} {result["dxf_version"]} {result["backend"]:<6} '
+            f'{result["signs_per_second"]:>9.0f} signs/s  read {seconds["read"]:.2f}s layout {seconds["layout"]:.2f}s '
+            f'draw {seconds["draw"]:.2f}s save {seconds["save"]:.2f}s  '
+            f'{"?" if memory is None else f"{memory:.0f}"} MB peak  {result["output_bytes"] / 1e6:.1f} MB output')
+
+
+# Print the change of each case that is found in both result lists.
+def compare(previous: List[Dict[str, Any]], current: List[Dict[str, Any]]) -> None:
+    def key(result: Dict[str, Any]) -> Tuple[Any, ...]:
+        return Case(**{name: result[name] for name in Case.__dataclass_fields__}).key
+    previous = {key(result): result for result in previous}
+    for result in current:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        speed = result['signs_per_second'] / old['signs_per_second']
+        memory = ''
+        if result['peak_memory_mb'] and old['peak_memory_mb']:
+            memory = f', peak memory {result["peak_memory_mb"] / old["peak_memory_mb"]:.2f}x'
+        size = result['output_bytes'] / old['output_bytes'] if old['output_bytes'] else 1.0
+        print(f'{result["config"]:<5} {result["rows"]:>7} {result["values"]:<5} {result["dxf_version"]} {result["backend"]:<6} '
+              f'speed {speed:.2f}x{memory}, output size {size:.2f}x')
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Measure sign generation throughput, memory use and output size.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000],
+                        help='numbers of spreadsheet rows to run (default: 1000)')
+    parser.add_argument('--values', nargs='+', choices=VALUE_OPTIONS, default=['short'],
+                        help='length of the synthetic values (default: short)')
+    parser.add_argument('--configs', nargs='+', choices=tuple(CONFIGS), default=list(CONFIGS),
+                        help='sign configurations to run (default: all)')
+    parser.add_argument('--versions', nargs='+', choices=DXF_VERSIONS, default=list(DXF_VERSIONS),
+                        help='DXF versions to run (default: all)')
+    parser.add_argument('--backends', nargs='+', choices=Job.BACKEND_OPTIONS, default=[Job.BACKEND_OPTIONS[0]],
+                        help='output backends to run (default: EZDXF)')
+    parser.add_argument('--layers', type=int, default=10,
+                        help='layers per sheet (default: 10)')
+    parser.add_argument('--data', help='directory for the synthetic spreadsheets, kept between runs (default: temporary)')
+    parser.add_argument('-o', '--output', help='save the results to a JSON file')
+    parser.add_argument('--compare', help='compare the results with an earlier JSON file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        data_directory = Path(args.data or temporary_directory)
+        data_directory.mkdir(parents=True, exist_ok=True)
+        output_directory = Path(temporary_directory)
+        results = []
+        for rows in args.rows:
+            for values in args.values:
+                data_path = spreadsheet_path(data_directory, rows, values)
+                for config in args.configs:
+                    for dxf_version in args.versions:
+                        for backend in args.backends:
+                            case = Case(config, rows, values, dxf_version, backend, args.layers)
+                            result = run_isolated(case, data_path, output_directory)
+                            print(describe(result))
+                            results.append(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'environment': environment(), 'results': results}, file, indent=4)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            compare(json.load(file)['results'], results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
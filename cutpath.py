@@ -0,0 +1,171 @@
+'''
+KylttiMaker cut path optimization
+
+Orders the cut entities of each layer (outline lines, holes and other
+polylines) so the laser head travels as little as possible between them. A
+nearest-neighbour tour is built with a grid of cells so only nearby entities
+are looked at, and then improved with 2-opt moves between entities close to
+each other in the tour. Lines and polylines can be cut in either direction;
+holes start and end at their center. Cut and travel lengths are estimated
+from the same geometry.
+'''
+
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# How many following entities of the tour each entity is tried to swap with in 2-opt.
+TWO_OPT_WINDOW = 32
+# Maximum amount of 2-opt passes over the tour.
+TWO_OPT_PASSES = 8
+
+Point = Tuple[float, float]
+
+
+# Entity to be cut: where cutting starts and ends, how long the cut is and how to draw it.
+class Cut:
+    def __init__(self, start: Point, end: Point, length: float, kind: str, geometry: Any, dxfattribs: Dict[str, Any]) -> None:
+        self.start = start
+        self.end = end
+        self.length = length
+        self.kind = kind
+        self.geometry = geometry
+        self.dxfattribs = dxfattribs
+
+    # The same cut made in the opposite direction.
+    def reversed(self) -> 'Cut':
+        geometry = self.geometry[::-1] if self.kind == 'POLYLINE' else self.geometry
+        return Cut(self.end, self.start, self.length, self.kind, geometry, self.dxfattribs)
+
+
+# Length of the travel from the origin through the cuts in the given order.
+def travel_length(cuts: Sequence[Cut], origin: Point = (0.0, 0.0)) -> float:
+    length = 0.0
+    position = origin
+    for cut in cuts:
+        length += math.dist(position, cut.start)
+        position = cut.end
+    return length
+
+
+# Greedy tour from the origin to the nearest free end of any cut. Cut ends are put into square cells so
+# the search only visits the cells around the current position, ring by ring.
+def nearest_neighbour(cuts: Sequence[Cut], origin: Point = (0.0, 0.0)) -> List[Cut]:
+    if not cuts:
+        return []
+    xs = [point[0] for cut in cuts for point in (cut.start, cut.end)]
+    ys = [point[1] for cut in cuts for point in (cut.start, cut.end)]
+    min_x, min_y = min(xs), min(ys)
+    cell_size = max(max(xs) - min_x, max(ys) - min_y) / max(1.0, math.sqrt(len(cuts))) or 1.0
+    cells: Dict[Tuple[int, int], List[Tuple[int, bool]]] = {}
+    for index, cut in enumerate(cuts):
+        for reverse, (x, y) in ((False, cut.start), (True, cut.end)):
+            cells.setdefault((int((x - min_x) // cell_size), int((y - min_y) // cell_size)), []).append((index, reverse))
+    columns = int((max(xs) - min_x) // cell_size) + 1
+    rows = int((max(ys) - min_y) // cell_size) + 1
+
+    used = [False] * len(cuts)
+    tour = []
+    position = origin
+    for _ in range(len(cuts)):
+        column = min(max(int((position[0] - min_x) // cell_size), 0), columns - 1)
+        row = min(max(int((position[1] - min_y) // cell_size), 0), rows - 1)
+        best: Optional[Tuple[float, int, bool]] = None
+        ring = 0
+        # Entities in ring r + 1 are at least r cells away, so the search stops once the best one is closer.
+        while best is None or best[0] > (ring - 1) * cell_size:
+            if ring > max(columns, rows):
+                break
+            for cell in ring_cells(column, row, ring):
+                for index, reverse in cells.get(cell, ()):
+                    if not used[index]:
+                        distance = math.dist(position, cuts[index].end if reverse else cuts[index].start)
+                        if best is None or distance < best[0]:
+                            best = (distance, index, reverse)
+            ring += 1
+        _, index, reverse = best
+        used[index] = True
+        cut = cuts[index].reversed() if reverse else cuts[index]
+        tour.append(cut)
+        position = cut.end
+    return tour
+
+
+# Cells at the given ring (Chebyshev distance) around a cell.
+def ring_cells(column: int, row: int, ring: int) -> List[Tuple[int, int]]:
+    if ring == 0:
+        return [(column, row)]
+    cells = [(column + offset, row + side) for offset in range(-ring, ring + 1) for side in (-ring, ring)]
+    cells.extend((column + side, row + offset) for offset in range(-ring + 1, ring) for side in (-ring, ring))
+    return cells
+
+
+# Improve a tour with 2-opt moves: cutting a stretch of the tour in reverse order (and each cut of it in
+# the opposite direction) whenever that shortens the travel. Only stretches of up to the window length
+# are tried, which keeps a pass linear in the number of cuts.
+def two_opt(tour: List[Cut], origin: Point = (0.0, 0.0), window: int = TWO_OPT_WINDOW, passes: int = TWO_OPT_PASSES) -> List[Cut]:
+    tour = list(tour)
+    count = len(tour)
+    for _ in range(passes):
+        improved = False
+        for first in range(count - 1):
+            before = tour[first - 1].end if first > 0 else origin
+            for last in range(first + 1, min(first + window, count)):
+                after = tour[last + 1].start if last + 1 < count else None
+                old = math.dist(before, tour[first].start)
+                new = math.dist(before, tour[last].end)
+                if after is not None:
+                    old += math.dist(tour[last].end, after)
+                    new += math.dist(tour[first].start, after)
+                if new < old - 1e-9:
+                    tour[first:last + 1] = [cut.reversed() for cut in reversed(tour[first:last + 1])]
+                    improved = True
+        if not improved:
+            break
+    return tour
+
+
+# Order cuts to minimize travel from the origin.
+def order_cuts(cuts: Sequence[Cut], origin: Point = (0.0, 0.0)) -> List[Cut]:
+    return two_opt(nearest_neighbour(cuts, origin), origin)
+
+
+# Stand-in for a layout that holds back cut entities (polylines and circles) and passes everything else
+# through. The held back entities are drawn per layer in optimized order by flush().
+class CutCollector:
+    def __init__(self, layout: Any) -> None:
+        self.layout = layout
+        self.layers: Dict[str, List[Cut]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.layout, name)
+
+    def add_lwpolyline(self, points: Sequence[Sequence[float]], dxfattribs: Optional[Dict[str, Any]] = None) -> None:
+        dxfattribs = dxfattribs or {}
+        points = [(float(point[0]), float(point[1])) for point in points]
+        length = sum(math.dist(start, end) for start, end in zip(points, points[1:]))
+        self.layers.setdefault(dxfattribs.get('layer', '0'), []).append(
+            Cut(points[0], points[-1], length, 'POLYLINE', points, dxfattribs))
+
+    def add_circle(self, center: Sequence[float], radius: float, dxfattribs: Optional[Dict[str, Any]] = None) -> None:
+        dxfattribs = dxfattribs or {}
+        center = (float(center[0]), float(center[1]))
+        self.layers.setdefault(dxfattribs.get('layer', '0'), []).append(
+            Cut(center, center, 2 * math.pi * radius, 'CIRCLE', (center, radius), dxfattribs))
+
+    # Draw the held back entities of each layer in optimized order. Returns the cut length, the travel
+    # length in drawing order and the travel length in optimized order.
+    def flush(self) -> Tuple[float, float, float]:
+        cut = unordered = ordered = 0.0
+        for cuts in self.layers.values():
+            tour = order_cuts(cuts)
+            cut += sum(entity.length for entity in cuts)
+            unordered += travel_length(cuts)
+            ordered += travel_length(tour)
+            for entity in tour:
+                if entity.kind == 'POLYLINE':
+                    self.layout.add_lwpolyline(entity.geometry, dxfattribs=entity.dxfattribs)
+                else:
+                    center, radius = entity.geometry
+                    self.layout.add_circle(center, radius, dxfattribs=entity.dxfattribs)
+        self.layers = {}
+        return cut, unordered, ordered
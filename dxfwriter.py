@@ -0,0 +1,216 @@
+'''
+KylttiMaker direct DXF writer
+
+Writes the entities of a sheet's modelspace straight to a temporary file as
+DXF tags instead of building ezdxf entity objects. Everything else (header,
+tables, blocks and objects) is still made by ezdxf, which also hands out the
+entity handles, so the saved file has the same content ezdxf would write.
+Only the entity types and attributes this tool draws are supported.
+'''
+
+import io
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import ezdxf
+from ezdxf.lldxf.tagwriter import BinaryTagWriter
+
+# Start of the ENTITIES section and the end of a section as ezdxf writes them in ASCII and binary DXF.
+ENTITIES_SECTION = '  0\nSECTION\n  2\nENTITIES\n'
+END_SECTION = '  0\nENDSEC\n'
+BINARY_ENTITIES_SECTION = b'\x00\x00SECTION\x00\x02\x00ENTITIES\x00'
+BINARY_END_SECTION = b'\x00\x00ENDSEC\x00'
+# Size of the buffer of the temporary entity file.
+BUFFER_SIZE = 1 << 20
+
+# Horizontal and vertical alignment flags of text alignments.
+TEXT_ALIGN_FLAGS = {
+    'TOP_LEFT': (0, 3), 'TOP_CENTER': (1, 3), 'TOP_RIGHT': (2, 3),
+    'MIDDLE_LEFT': (0, 2), 'MIDDLE_CENTER': (1, 2), 'MIDDLE_RIGHT': (2, 2),
+    'BOTTOM_LEFT': (0, 1), 'BOTTOM_CENTER': (1, 1), 'BOTTOM_RIGHT': (2, 1),
+    'LEFT': (0, 0), 'CENTER': (1, 0), 'RIGHT': (2, 0)
+}
+
+
+# Hatch boundary paths collected until the hatch is written.
+class HatchPaths:
+    def __init__(self) -> None:
+        self.paths: List[Tuple[Sequence[Sequence[float]], int]] = []
+
+    def add_polyline_path(self, path_vertices: Sequence[Sequence[float]], is_closed: int = 1) -> None:
+        self.paths.append((path_vertices, is_closed))
+
+
+# Solid hatch that is written when the next entity is added or the sheet is saved.
+class Hatch:
+    def __init__(self, color: int, dxfattribs: Dict[str, Any]) -> None:
+        self.color = int(color)
+        self.dxfattribs = dxfattribs
+        self.paths = HatchPaths()
+
+    def dxfstr(self, handle: str, owner: str) -> str:
+        tags = [f'  0\nHATCH\n  5\n{handle}\n330\n{owner}\n100\nAcDbEntity\n  8\n{self.dxfattribs.get("layer", "0")}\n'
+                f' 62\n{self.color}\n100\nAcDbHatch\n 10\n0.0\n 20\n0.0\n 30\n0.0\n210\n0.0\n220\n0.0\n230\n1.0\n'
+                f'  2\nSOLID\n 70\n1\n 71\n0\n 91\n{len(self.paths.paths)}\n']
+        for vertices, is_closed in self.paths.paths:
+            tags.append(f' 92\n3\n 72\n0\n 73\n{is_closed}\n 93\n{len(vertices)}\n')
+            tags.append(''.join(f' 10\n{float(x)!r}\n 20\n{float(y)!r}\n' for x, y in vertices))
+            tags.append(' 97\n0\n')
+        tags.append(f' 75\n{self.dxfattribs.get("hatch_style", 0)}\n 76\n1\n 98\n0\n')
+        return ''.join(tags)
+
+
+# Text that is written when the next entity is added or the sheet is saved.
+class Text:
+    def __init__(self, text: str, dxfattribs: Dict[str, Any]) -> None:
+        self.text = text
+        self.dxfattribs = dxfattribs
+        self.align_point: Optional[Tuple[float, float]] = None
+        self.align = 'LEFT'
+
+    def set_pos(self, p1: Sequence[float], align: Optional[str] = None) -> 'Text':
+        self.align_point = (float(p1[0]), float(p1[1]))
+        if align is not None:
+            self.align = align
+        return self
+
+    def dxfstr(self, handle: str, owner: str) -> str:
+        x, y = self.align_point or (0.0, 0.0)
+        halign, valign = TEXT_ALIGN_FLAGS[self.align]
+        tags = [f'  0\nTEXT\n  5\n{handle}\n330\n{owner}\n100\nAcDbEntity\n  8\n{self.dxfattribs.get("layer", "0")}\n'
+                f'100\nAcDbText\n 10\n{x!r}\n 20\n{y!r}\n 30\n0.0\n 40\n{float(self.dxfattribs.get("height", 2.5))!r}\n'
+                f'  1\n{self.text}\n']
+        if halign:
+            tags.append(f' 72\n{halign}\n')
+        if self.align_point is not None:
+            tags.append(f' 11\n{x!r}\n 21\n{y!r}\n 31\n0.0\n')
+        tags.append('100\nAcDbText\n')
+        if valign:
+            tags.append(f' 73\n{valign}\n')
+        return ''.join(tags)
+
+
+# Stand-in for an ezdxf modelspace that streams the supported entities to a temporary file.
+class EntityWriter:
+    def __init__(self, sheet: ezdxf.drawing.Drawing) -> None:
+        self.drawing = sheet
+        self.handles = sheet.entitydb.handles
+        self.owner = sheet.modelspace().layout_key
+        self.file = tempfile.TemporaryFile(
+            'w+', buffering=BUFFER_SIZE, encoding='utf-8', newline='')
+        # Hatches and texts are changed after they are added, so the last one is written later.
+        self.pending: Optional[Union[Hatch, Text]] = None
+        self.pending_handle = ''
+
+    def flush_pending(self) -> None:
+        if self.pending is not None:
+            self.file.write(self.pending.dxfstr(
+                self.pending_handle, self.owner))
+            self.pending = None
+
+    # Write an entity record (tags after the owner handle) and return the handle of the entity.
+    def write(self, dxftype: str, layer: str, tags: str) -> str:
+        self.flush_pending()
+        handle = self.handles.next()
+        self.file.write(f'  0\n{dxftype}\n  5\n{handle}\n330\n{self.owner}\n100\nAcDbEntity\n  8\n{layer}\n{tags}')
+        return handle
+
+    def add_pending(self, entity: Union[Hatch, Text]) -> None:
+        self.flush_pending()
+        self.pending = entity
+        self.pending_handle = self.handles.next()
+
+    def add_lwpolyline(self, points: Iterable[Sequence[float]], dxfattribs: Optional[Dict[str, Any]] = None) -> None:
+        dxfattribs = dxfattribs or {}
+        points = [(float(point[0]), float(point[1])) for point in points]
+        self.write('LWPOLYLINE', dxfattribs.get('layer', '0'), f'100\nAcDbPolyline\n 90\n{len(points)}\n 70\n0\n' +
+                   ''.join(f' 10\n{x!r}\n 20\n{y!r}\n' for x, y in points))
+
+    def add_circle(self, center: Sequence[float], radius: float, dxfattribs: Optional[Dict[str, Any]] = None) -> None:
+        dxfattribs = dxfattribs or {}
+        self.write('CIRCLE', dxfattribs.get('layer', '0'),
+                   f'100\nAcDbCircle\n 10\n{float(center[0])!r}\n 20\n{float(center[1])!r}\n 30\n0.0\n 40\n{float(radius)!r}\n')
+
+    def add_blockref(self, name: str, insert: Sequence[float], dxfattribs: Optional[Dict[str, Any]] = None) -> None:
+        dxfattribs = dxfattribs or {}
+        rotation = dxfattribs.get('rotation')
+        self.write('INSERT', dxfattribs.get('layer', '0'), f'100\nAcDbBlockReference\n  2\n{name}\n'
+                   f' 10\n{float(insert[0])!r}\n 20\n{float(insert[1])!r}\n 30\n0.0\n' +
+                   (f' 50\n{float(rotation)!r}\n' if rotation is not None else ''))
+        self.handles.next()  # ezdxf reserves a handle for the SEQEND of attributes.
+
+    def add_hatch(self, color: int = 7, dxfattribs: Optional[Dict[str, Any]] = None) -> Hatch:
+        hatch = Hatch(color, dxfattribs or {})
+        # Tracked like ezdxf's entity factory does, so the drawing gets the HATCHBACKGROUNDCOLOR APPID.
+        self.drawing.tracker.dxftypes.add('HATCH')
+        self.add_pending(hatch)
+        return hatch
+
+    def add_text(self, text: Any, dxfattribs: Optional[Dict[str, Any]] = None) -> Text:
+        entity = Text(str(text), dxfattribs or {})
+        self.add_pending(entity)
+        return entity
+
+    # Copy the written entities to a stream.
+    def copy_to(self, stream: io.TextIOBase) -> None:
+        self.flush_pending()
+        self.file.flush()
+        self.file.seek(0)
+        shutil.copyfileobj(self.file, stream, BUFFER_SIZE)
+        self.file.seek(0, io.SEEK_END)
+
+    # Write the entities as binary tags.
+    def copy_binary_to(self, tagwriter: BinaryTagWriter) -> None:
+        self.flush_pending()
+        self.file.flush()
+        self.file.seek(0)
+        lines = iter(self.file)
+        for code in lines:
+            tagwriter.write_tag2(int(code), next(lines)[:-1])
+        self.file.seek(0, io.SEEK_END)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Sheet whose modelspace entities are written by an EntityWriter. Used in place of an ezdxf drawing.
+class DirectSheet:
+    def __init__(self, dxf_version: str) -> None:
+        self.drawing = ezdxf.new(dxf_version)
+        self.blocks = self.drawing.blocks
+        self.entities = EntityWriter(self.drawing)
+
+    def modelspace(self) -> EntityWriter:
+        return self.entities
+
+    # Save the sheet with the same encoding ezdxf uses, inserting the streamed entities into the ENTITIES section.
+    # Format is 'asc' for ASCII or 'bin' for binary DXF.
+    def saveas(self, filename: Union[str, Path], fmt: str = 'asc') -> None:
+        if fmt == 'bin':
+            self.save_binary(filename)
+            return
+        skeleton = io.StringIO()
+        self.drawing.write(skeleton)
+        skeleton = skeleton.getvalue()
+        start = skeleton.index(ENTITIES_SECTION) + len(ENTITIES_SECTION)
+        end = skeleton.index(END_SECTION, start)
+        with open(filename, 'wt', encoding=self.drawing.output_encoding, errors='dxfreplace') as file:
+            file.write(skeleton[:end])
+            self.entities.copy_to(file)
+            file.write(skeleton[end:])
+
+    def save_binary(self, filename: Union[str, Path]) -> None:
+        skeleton = io.BytesIO()
+        self.drawing.write(skeleton, fmt='bin')
+        skeleton = skeleton.getvalue()
+        start = skeleton.index(BINARY_ENTITIES_SECTION) + len(BINARY_ENTITIES_SECTION)
+        end = skeleton.index(BINARY_END_SECTION, start)
+        with open(filename, 'wb', buffering=BUFFER_SIZE) as file:
+            file.write(skeleton[:end])
+            self.entities.copy_binary_to(BinaryTagWriter(
+                file, dxfversion=self.drawing.dxfversion, encoding=self.drawing.output_encoding))
+            file.write(skeleton[end:])
+
+    def close(self) -> None:
+        self.entities.close()
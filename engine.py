@@ -0,0 +1,1536 @@
+'''
+KylttiMaker engine
+
+Headless layout and render engine used by both the GUI and the command line.
+Mark settings are frozen into immutable spec objects once per job so that the
+drawing loop only deals with plain Python values.
+
+Usage: python engine.py job.json -o output
+'''
+
+import argparse
+import array
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.synchronize
+import os
+import sys
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from functools import cached_property, lru_cache
+from itertools import accumulate
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import ezdxf
+import numpy as np
+import pyqrcode
+from pyqrcode.builder import QRCodeBuilder
+from cutpath import CutCollector
+from dxfwriter import DirectSheet
+from glyphs import align_offset, glyph_outline, load_font, text_outlines
+from metrics import DISABLED, Metrics
+from nesting import NestingPlan, Placement, cut_lines, nest
+from spreadsheet import read_columns
+
+DXF_VERSIONS = ('R2000', 'R2004', 'R2007', 'R2010', 'R2013', 'R2018')
+# Maximum amount of distinct QR codes kept in memory.
+QR_CACHE_SIZE = 4096
+# Code points of the characters of the QR code alphanumeric mode.
+QR_ALPHANUMERIC_POINTS = np.array(sorted(map(ord, pyqrcode.tables.ascii_codes)))
+# Slack allowed when checking that marks fit on their signs (drawing units).
+FIT_TOLERANCE = 1e-6
+# Seconds between checks for cancellation while waiting for worker processes.
+CANCEL_POLL_INTERVAL = 0.1
+# Threads saving drawn sheets while the next one is drawn (with a single worker).
+SAVE_THREADS = 2
+# Manifest of sheet hashes used by incremental runs. The version is changed when the drawing changes.
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 4
+# Version of job manifests that fix the sheets of a job for sharded runs.
+JOB_MANIFEST_VERSION = 1
+
+
+# Raised when a job is cancelled before it is finished.
+class Cancelled(Exception):
+    pass
+
+
+# Fixed parts of a QR code of the given version: the function patterns (-1 where free), the positions
+# of the format (type) bits with the index of the bit drawn there and the positions of the data bits
+# in placement order. The patterns are drawn by pyqrcode's own builder so the result matches it exactly.
+@lru_cache(maxsize=None)
+def qr_template(version: int) -> Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+    size = pyqrcode.tables.version_size[version]
+    builder = SimpleNamespace(version=version)
+    patterns = [[' '] * size for _ in range(size)]
+    QRCodeBuilder.add_detection_pattern(builder, patterns)
+    QRCodeBuilder.add_position_pattern(builder, patterns)
+    QRCodeBuilder.add_version_pattern(builder, patterns)
+    template = np.array([[-1 if module == ' ' else module for module in row]
+                         for row in patterns], dtype=np.int8)
+
+    type_bits = np.full((size, size), -1, dtype=np.int8)
+    QRCodeBuilder.add_type_pattern(builder, type_bits, range(15))
+    type_rows, type_columns = np.nonzero(type_bits >= 0)
+    type_positions = (type_rows, type_columns,
+                      type_bits[type_rows, type_columns])
+
+    # Data goes upwards and downwards in turns through pairs of columns from right to left.
+    free = (template == -1) & (type_bits == -1)
+    data_rows, data_columns = [], []
+    upwards = True
+    for column in range(size - 1, 0, -2):
+        if column <= 6:  # Skip the vertical timing pattern.
+            column -= 1
+        for row in (range(size - 1, -1, -1) if upwards else range(size)):
+            for col in (column, column - 1):
+                if free[row, col]:
+                    data_rows.append(row)
+                    data_columns.append(col)
+        upwards = not upwards
+    return template, type_positions, (np.array(data_rows), np.array(data_columns))
+
+
+# All eight mask patterns of a QR code of the given size.
+@lru_cache(maxsize=None)
+def qr_mask_patterns(size: int) -> np.ndarray:
+    rows, columns = np.indices((size, size))
+    return np.array([pattern(rows, columns) for pattern in pyqrcode.tables.mask_patterns])
+
+
+# Penalty scores of stacked candidate codes with the rules (and quirks) of pyqrcode's builder.
+def qr_penalties(codes: np.ndarray) -> List[int]:
+    size = codes.shape[-1]
+
+    # Rule 1: runs of five or more same coloured modules in a row or a column score 3 + 1 per extra module.
+    def runs(lines: np.ndarray) -> np.ndarray:
+        same = lines[..., 1:] == lines[..., :-1]
+        windows = same[..., :-3] & same[..., 1:-2] & same[..., 2:-1] & same[..., 3:]
+        run_starts = windows.copy()
+        run_starts[..., 1:] &= ~same[..., :-4]
+        return windows.sum(axis=(1, 2)) + 2 * run_starts.sum(axis=(1, 2))
+    scores = runs(codes) + runs(codes.transpose(0, 2, 1))
+
+    # Rule 2: 3 for each 2x2 block of the same colour.
+    corner = codes[:, :-1, :-1]
+    blocks = (corner == codes[:, 1:, :-1]) & (
+        corner == codes[:, :-1, 1:]) & (corner == codes[:, 1:, 1:])
+    scores += 3 * blocks.sum(axis=(1, 2))
+
+    # Rule 3: 40 for each finder like pattern in a row or a column.
+    for pattern in ((0, 0, 0, 0, 1, 0, 1, 1, 1, 0, 1), (1, 0, 1, 1, 1, 0, 1, 0, 0, 0, 0)):
+        pattern = np.array(pattern, dtype=bool)
+        for lines in (codes, codes.transpose(0, 2, 1)):
+            windows = np.lib.stride_tricks.sliding_window_view(
+                lines, len(pattern), axis=2)
+            scores += 40 * (windows == pattern).all(axis=3).sum(axis=(1, 2))
+
+    # Rule 4: 10 for every 5 % the share of dark modules differs from 50 %.
+    penalties = []
+    for score, dark in zip(scores.tolist(), codes.sum(axis=(1, 2)).tolist()):
+        percent = dark / size ** 2 * 100 - 50
+        penalties.append(score + int((abs(int(percent)) / 5) * 10))
+    return penalties
+
+
+# pyqrcode builder that places the data and chooses the mask with NumPy instead of nested Python loops.
+# The resulting code is a boolean array and identical to the one pyqrcode would build.
+class QRArrayBuilder(QRCodeBuilder):
+    def make_code(self) -> None:
+        template, (type_rows, type_columns, type_indices), (data_rows, data_columns) = qr_template(self.version)
+        size = len(template)
+
+        bits = np.frombuffer(self.buffer.getvalue().encode(
+            'ascii'), dtype=np.uint8)[:len(data_rows)] == ord('1')
+        data = np.zeros(len(data_rows), dtype=bool)
+        data[:len(bits)] = bits  # Missing remainder bits are zeros.
+
+        codes = np.empty((8, size, size), dtype=bool)
+        codes[:] = template == 1
+        flips = qr_mask_patterns(size)[:, data_rows, data_columns]
+        codes[:, data_rows, data_columns] = data ^ flips
+        for mask_index in range(8):
+            type_bits = np.array(
+                [bit == '1' for bit in pyqrcode.tables.type_bits[self.error][mask_index]])
+            codes[mask_index, type_rows, type_columns] = type_bits[type_indices]
+
+        penalties = qr_penalties(codes)
+        self.best_mask = penalties.index(min(penalties))
+        self.code = codes[self.best_mask]
+
+
+# QR code module matrix as a read-only boolean array (True = dark). Mode detection, version fitting and
+# data encoding are done by pyqrcode the same way as pyqrcode.create(value, error=error) does them.
+# Repeated values are served from a bounded LRU cache.
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_matrix(value: Any, error: str = 'H') -> np.ndarray:
+    mode, data = qr_content(value)
+    code = pyqrcode.QRCode.__new__(pyqrcode.QRCode)
+    code.mode_num = pyqrcode.tables.modes[mode]
+    code.error = pyqrcode.tables.error_level[error]
+    version = code._pick_best_fit(data)
+    matrix = QRArrayBuilder(data, version, mode, code.error).code
+    matrix.flags.writeable = False
+    return matrix
+
+
+# Encode a whole column of values in bulk, each distinct value only once. The boundary paths of the given
+# geometry are built at the same time, so drawing the values afterwards only reads the caches.
+def encode_column(values: Sequence[Any], error: str = 'H', geometry: str = 'MODULES') -> List[np.ndarray]:
+    matrices = {}
+    for value in values:
+        if value not in matrices:
+            matrices[value] = qr_matrix(value, error)
+            qr_paths(value, error, geometry)
+    return [matrices[value] for value in values]
+
+
+# Mode and encoded data of a QR code value, detected and encoded the way pyqrcode.create(value) does.
+# Raises UnicodeError for text that can not be encoded.
+def qr_content(value: Any) -> Tuple[str, Any]:
+    code = pyqrcode.QRCode.__new__(pyqrcode.QRCode)
+    mode, encoding = code._detect_content_type(value, 'iso-8859-1')
+    encoding = 'shiftjis' if mode == 'kanji' else encoding or 'iso-8859-1'
+    if isinstance(value, bytes):
+        data = value.decode(encoding)
+    elif hasattr(value, 'encode'):
+        data = value.encode(encoding)
+    else:
+        data = str(value)
+    return mode, data
+
+
+# Smallest QR code version fitting each value of a column at the given error correction level: 0 if no
+# version is large enough and -1 if the value can not be encoded. The mode of ASCII values (nearly all of
+# them) is found from the characters of the whole column at once, other values are encoded by pyqrcode.
+# Versions are then looked up from pyqrcode's capacity table for all values at once.
+def qr_versions(values: 'Column', error: str = 'H') -> np.ndarray:
+    modes = pyqrcode.tables.modes
+    points = values.code_points()
+    lengths = values.value_sums(np.ones(len(points), dtype=int))
+    digits = values.value_sums((points >= ord('0')) & (points <= ord('9'))) == lengths
+    alphanumeric = values.value_sums(np.isin(points, QR_ALPHANUMERIC_POINTS)) == lengths
+    mode_numbers = np.where(digits & (lengths > 0), modes['numeric'],
+                            np.where(alphanumeric, modes['alphanumeric'], modes['binary']))
+    for index in np.flatnonzero(values.value_sums(points >= 128)).tolist():
+        try:
+            mode, data = qr_content(values[index])
+        except UnicodeError:
+            lengths[index] = -1
+            continue
+        mode_numbers[index] = modes[mode]
+        lengths[index] = -(-len(data) // 2) if mode == 'kanji' else len(data)
+
+    capacities = pyqrcode.tables.data_capacity
+    versions = np.full(len(lengths), -1, dtype=int)
+    for mode_number in modes.values():
+        selected = (mode_numbers == mode_number) & (lengths >= 0)
+        capacity = [capacities[version][error][mode_number] for version in range(1, 41)]
+        found = np.searchsorted(capacity, lengths[selected]) + 1
+        versions[selected] = np.where(found > 40, 0, found)
+    return versions
+
+
+# Dark modules of a QR code as rectangles (left, top, right, bottom) one module each.
+def module_squares(matrix: np.ndarray) -> np.ndarray:
+    rows, columns = np.nonzero(matrix)
+    return np.column_stack((columns, rows, columns + 1, rows + 1))
+
+
+# Dark modules of a QR code merged into horizontal runs.
+def module_runs(matrix: np.ndarray) -> np.ndarray:
+    edges = np.diff(np.pad(matrix, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return np.column_stack((starts, rows, ends, rows + 1))
+
+
+# Dark modules of a QR code merged greedily into maximal rectangles that do not overlap.
+def module_rectangles(matrix: np.ndarray) -> np.ndarray:
+    height, width = matrix.shape
+    free = matrix.tolist()
+    rectangles = []
+    for y, x in zip(*np.nonzero(matrix)):
+        row = free[y]
+        if not row[x]:
+            continue
+        # Extend right as far as possible and then down as long as the whole span is still free.
+        right = x + 1
+        while right < width and row[right]:
+            right += 1
+        bottom = y + 1
+        while bottom < height and all(free[bottom][x:right]):
+            bottom += 1
+        for covered in free[y:bottom]:
+            covered[x:right] = [False] * (right - x)
+        rectangles.append((x, y, right, bottom))
+    return np.array(rectangles, dtype=int).reshape(-1, 4)
+
+
+# Outer and inner contours of the connected dark regions of a QR code. Contours are traced along
+# module edges with the dark side on the right, so regions touching only diagonally stay separate.
+def module_contours(matrix: np.ndarray) -> List[List[Tuple[int, int]]]:
+    padded = np.pad(matrix, 1)
+    # Directed boundary edges keyed by their start vertex.
+    edges = {}
+    for boundary, start, end in (
+        (matrix & ~padded[:-2, 1:-1], (0, 0), (1, 0)),  # Top.
+        (matrix & ~padded[1:-1, 2:], (1, 0), (1, 1)),  # Right.
+        (matrix & ~padded[2:, 1:-1], (1, 1), (0, 1)),  # Bottom.
+        (matrix & ~padded[1:-1, :-2], (0, 1), (0, 0))  # Left.
+    ):
+        rows, columns = np.nonzero(boundary)
+        for x, y in zip(columns.tolist(), rows.tolist()):
+            edges.setdefault((x + start[0], y + start[1]), []).append(
+                (x + end[0], y + end[1]))
+
+    contours = []
+    while edges:
+        start = next(iter(edges))
+        contour = []
+        vertex = start
+        direction = first_direction = None
+        while True:
+            ends = edges[vertex]
+            end = ends[0]
+            # On vertices shared by diagonally touching regions prefer turning right, towards the dark side.
+            if len(ends) > 1 and direction:
+                right_turn = (vertex[0] - direction[1], vertex[1] + direction[0])
+                if right_turn in ends:
+                    end = right_turn
+            ends.remove(end)
+            if not ends:
+                del edges[vertex]
+            new_direction = (end[0] - vertex[0], end[1] - vertex[1])
+            # Only keep the corners.
+            if new_direction != direction:
+                contour.append(vertex)
+            direction = new_direction
+            first_direction = first_direction or direction
+            vertex = end
+            if vertex == start:
+                break
+        if direction == first_direction:
+            contour.pop(0)
+        contours.append(contour)
+    return contours
+
+
+# Boundary paths of the dark modules of a QR code in module coordinates (x right, y down) as the
+# number of modules per side, the vertices of all paths and the end index of each path's vertices.
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_paths(value: Any, error: str = 'H', geometry: str = 'MODULES') -> Tuple[int, np.ndarray, Tuple[int, ...]]:
+    matrix = qr_matrix(value, error)
+    if geometry == 'CONTOURS':
+        contours = module_contours(matrix)
+        vertices = np.array([vertex for contour in contours for vertex in contour],
+                            dtype=float).reshape(-1, 2)
+        ends = tuple(np.cumsum([len(contour) for contour in contours]).tolist())
+    else:
+        if geometry == 'RUNS':
+            rectangles = module_runs(matrix)
+        elif geometry == 'RECTANGLES':
+            rectangles = module_rectangles(matrix)
+        else:
+            rectangles = module_squares(matrix)
+        x0, y0, x1, y1 = rectangles.T
+        vertices = np.stack((x0, y0, x1, y0, x1, y1, x0, y1),
+                            axis=1).reshape(-1, 2).astype(float)
+        ends = tuple(range(4, len(vertices) + 1, 4))
+    vertices.flags.writeable = False
+    return len(matrix), vertices, ends
+
+
+# QR code mark settings.
+@dataclass(frozen=True)
+class QRSpec:
+    # How the dark modules are turned into hatch boundary paths.
+    GEOMETRY_OPTIONS = ('MODULES', 'RUNS', 'RECTANGLES', 'CONTOURS')
+    # Error correction levels from lowest (7 %) to highest (30 %).
+    ERROR_OPTIONS = ('L', 'M', 'Q', 'H')
+
+    position_x: float = 1.0
+    position_y: float = 1.0
+    size: float = 20.0
+    inverse: bool = False
+    padding: float = 0.0
+    geometry: str = 'MODULES'
+    error: str = 'H'
+    # Smallest module (dark or light square) that can still be cut and read, in drawing units.
+    min_module: float = 0.25
+
+    def __post_init__(self) -> None:
+        assert self.size > 0, 'QR code size must be greater than 0.'
+        assert self.min_module >= 0, 'Minimum QR module size must be positive.'
+        assert 0 <= self.padding < self.size / 2, 'QR code padding must leave room for the code.'
+        assert self.geometry in QRSpec.GEOMETRY_OPTIONS, f'Unknown QR geometry {self.geometry}.'
+        assert self.error in QRSpec.ERROR_OPTIONS, f'Unknown QR error correction level {self.error}.'
+
+    # Problems of the QR codes of the given values on signs of the given sizes, each as a message and a
+    # mask of the values it applies to. The module size follows from the version: a version v code has
+    # 17 + 4v modules across the size left inside the padding.
+    def check(self, values: 'Column', widths: np.ndarray, heights: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        versions = qr_versions(values, self.error)
+        module_sizes = (self.size - 2 * self.padding) / (17 + 4 * np.maximum(versions, 1))
+        return [
+            ('value can not be encoded in a QR code', versions == -1),
+            (f'value is too long for a QR code with error correction level {self.error}', versions == 0),
+            (f'QR code modules are smaller than {self.min_module:g}', (versions > 0) & (module_sizes < self.min_module)),
+            ('QR code reaches over the edge of the sign', off_sign(
+                self.position_x, self.position_y, self.position_x + self.size, self.position_y + self.size, widths, heights))
+        ]
+
+    # Draws the QR code on the modelspace of a sheet.
+    def draw(self, value: Any, modelspace: Any, layer: str, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
+        left = sign_origin_x + self.position_x
+        top = sign_origin_y - self.position_y
+        size = self.size
+
+        # Contours of nested regions (e.g. the centers of finder patterns) are only filled correctly
+        # with the normal (odd parity) hatch style, other geometries never nest.
+        hatch = modelspace.add_hatch(
+            dxfattribs={'layer': layer, 'hatch_style': 0 if self.geometry == 'CONTOURS' else 1})
+
+        if self.inverse:
+            hatch.paths.add_polyline_path([
+                (left, top),
+                (left + size, top),
+                (left + size, top - size),
+                (left, top - size)
+            ])
+
+        # Transform the cached module coordinates of all paths at once.
+        modules, vertices, ends = qr_paths(value, self.error, self.geometry)
+        cell_size = (size - 2 * self.padding) / modules
+        points = np.empty(vertices.shape)
+        points[:, 0] = left + self.padding + vertices[:, 0] * cell_size
+        points[:, 1] = top - self.padding - vertices[:, 1] * cell_size
+        points = points.tolist()
+
+        start = 0
+        for end in ends:
+            hatch.paths.add_polyline_path(points[start:end])
+            start = end
+
+
+# Text mark settings. With a font file the text is drawn as polyline outlines of its glyphs instead
+# of a TEXT entity.
+@dataclass(frozen=True)
+class TextSpec:
+    ALIGN_OPTIONS = (
+        'TOP_LEFT', 'TOP_CENTER', 'TOP_RIGHT',
+        'MIDDLE_LEFT', 'MIDDLE_CENTER', 'MIDDLE_RIGHT',
+        'BOTTOM_LEFT', 'BOTTOM_CENTER', 'BOTTOM_RIGHT'
+    )
+
+    position_x: float = 75.0
+    position_y: float = 11.0
+    size: float = 11.0
+    align: str = 'MIDDLE_CENTER'
+    font: str = ''
+
+    def __post_init__(self) -> None:
+        assert self.size >= 0, 'Font size must be positive.'
+        assert self.align in TextSpec.ALIGN_OPTIONS, f'Unknown align option {self.align}.'
+        assert not self.font or os.path.isfile(self.font), f'Font file {self.font} not found.'
+
+    # Problems of the texts of the given values on signs of the given sizes. With a font file the width of
+    # every text is summed from the advance widths of its characters, like text_box() does. TEXT entities
+    # are drawn with the font of the CAM software, so only their height and alignment point are checked.
+    def check(self, values: 'Column', widths: np.ndarray, heights: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        if self.font:
+            characters, inverse = np.unique(values.code_points(), return_inverse=True)
+            advances = np.array([glyph_outline(self.font, self.size, chr(character)).advance
+                                 for character in characters.tolist()], dtype=float)
+            text_widths = values.value_sums(advances[inverse])
+            font = load_font(self.font)
+            left, bottom = align_offset(self.align, text_widths, self.size, font.descender * self.size / font.cap_height)
+            right, top = left + text_widths, bottom + self.size
+        else:
+            left = right = 0.0
+            _, bottom = align_offset(self.align, 0.0, self.size, 0.0)
+            top = bottom + self.size
+        return [('text reaches over the edge of the sign', off_sign(
+            self.position_x + left, self.position_y - top, self.position_x + right, self.position_y - bottom, widths, heights))]
+
+    def draw(self, value: Any, modelspace: Any, layer: str, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
+        position = (
+            sign_origin_x + self.position_x,
+            sign_origin_y - self.position_y
+        )
+        if self.font:
+            for outline in text_outlines(self.font, self.size, str(value), self.align, *position):
+                modelspace.add_lwpolyline(outline, dxfattribs={'layer': layer})
+            return
+        modelspace.add_text(value, dxfattribs={'layer': layer, 'height': self.size}).set_pos(
+            position, align=self.align)
+
+
+# Hole mark settings.
+@dataclass(frozen=True)
+class HoleSpec:
+    position_x: float = 0.0
+    position_y: float = 0.0
+    diameter: float = 5.0
+
+    def __post_init__(self) -> None:
+        assert self.diameter >= 0, 'Diameter must be positive.'
+
+    def check(self, values: 'Column', widths: np.ndarray, heights: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        radius = self.diameter / 2
+        return [('hole reaches over the edge of the sign', off_sign(
+            self.position_x - radius, self.position_y - radius, self.position_x + radius, self.position_y + radius, widths, heights))]
+
+    def draw(self, value: Any, modelspace: Any, layer: str, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
+        modelspace.add_circle(
+            (sign_origin_x + self.position_x, sign_origin_y - self.position_y), self.diameter / 2, dxfattribs={'layer': layer})
+
+
+# Mask of the signs of the given sizes a rectangle does not fit on. The rectangle (left, top, right, bottom)
+# is relative to the top left corner of the sign with y pointing down, given for every sign or for all.
+def off_sign(left: Any, top: Any, right: Any, bottom: Any, widths: np.ndarray, heights: np.ndarray) -> np.ndarray:
+    outside = ((np.asarray(left) < -FIT_TOLERANCE) | (np.asarray(top) < -FIT_TOLERANCE) |
+               (right > widths + FIT_TOLERANCE) | (bottom > heights + FIT_TOLERANCE))
+    return np.broadcast_to(outside, widths.shape)
+
+
+MarkSpec = Union[QRSpec, TextSpec, HoleSpec]
+MARK_TYPES = {'QR': QRSpec, 'Text': TextSpec, 'Hole': HoleSpec}
+MARK_NAMES = {mark_type: name for name, mark_type in MARK_TYPES.items()}
+
+
+# Block definitions of a single sheet. Each distinct key is drawn once into a DXF BLOCK (relative to
+# the sign origin) and every occurrence is placed as an INSERT on the sign's layer.
+class BlockCache:
+    def __init__(self, sheet: Union[ezdxf.drawing.Drawing, DirectSheet], metrics: Metrics = DISABLED) -> None:
+        self.sheet = sheet
+        self.metrics = metrics
+        self.names = {}
+
+    def insert(self, key: Tuple[Any, ...], draw: Callable[[Any], None], modelspace: Any, layer: str, sign_origin_x: float, sign_origin_y: float, rotation: float = 0.0) -> None:
+        name = self.names.get(key)
+        if name is None:
+            name = f'{key[0]}{len(self.names)}'
+            # Entities on layer 0 inside a block inherit the layer of the INSERT.
+            draw(self.metrics.wrap(self.sheet.blocks.new(name)))
+            self.names[key] = name
+        dxfattribs = {'layer': layer}
+        if rotation:
+            dxfattribs['rotation'] = rotation
+        modelspace.add_blockref(
+            name, (sign_origin_x, sign_origin_y), dxfattribs=dxfattribs)
+
+
+# Values of a field as text, stored compactly as one string of all values and the offsets where each value
+# starts. Values are converted once when the column is made; numbers become text the way str() writes them,
+# which is also how the marks drew them before.
+class Column:
+    def __init__(self, values: Iterable[Any] = ()) -> None:
+        texts = [value if isinstance(value, str) else str(value) for value in values]
+        self.text = ''.join(texts)
+        self.offsets = array.array('q', accumulate(map(len, texts), initial=0))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Column index out of range.')
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self) -> Iterator[str]:
+        text = self.text
+        offsets = self.offsets
+        for index in range(len(self)):
+            yield text[offsets[index]:offsets[index + 1]]
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Column) and self.text == other.text and self.offsets == other.offsets
+
+    def __hash__(self) -> int:
+        return hash((self.text, self.offsets.tobytes()))
+
+    def __repr__(self) -> str:
+        return f'Column({len(self)} values)'
+
+    # Unicode code points of all values one after another.
+    def code_points(self) -> np.ndarray:
+        return np.frombuffer(self.text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+    # Sum of an amount given per character (e.g. computed from code_points()) over each value.
+    def value_sums(self, amounts: np.ndarray) -> np.ndarray:
+        totals = np.concatenate(([0], np.cumsum(amounts)))
+        offsets = np.frombuffer(self.offsets, dtype=np.int64)
+        return totals[offsets[1:]] - totals[offsets[:-1]]
+
+    # Offsets are pickled as one block of bytes instead of a list of numbers.
+    def __getstate__(self) -> Tuple[str, bytes]:
+        return self.text, self.offsets.tobytes()
+
+    def __setstate__(self, state: Tuple[str, bytes]) -> None:
+        self.text, offsets = state
+        self.offsets = array.array('q')
+        self.offsets.frombytes(offsets)
+
+
+# Values of a single field together with the marks they are drawn as. Values are kept as a Column.
+@dataclass(frozen=True)
+class FieldSpec:
+    values: Column = field(default_factory=Column)
+    marks: Tuple[MarkSpec, ...] = ()
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.values, Column):
+            object.__setattr__(self, 'values', Column(self.values))
+
+    # Draw field's marks with the given value. QR codes are placed as block references if blocks are given.
+    # The time spent on each mark type is added to its stage of the metrics.
+    def draw(self, value: str, modelspace: Any, layer: str, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float, blocks: Optional[BlockCache] = None, metrics: Metrics = DISABLED) -> None:
+        for mark in self.marks:
+            with metrics.stage(MARK_NAMES[type(mark)]):
+                if blocks is not None and isinstance(mark, QRSpec):
+                    blocks.insert(('QR', mark, value), lambda block: mark.draw(
+                        value, block, '0', 0.0, 0.0, sign_width, sign_height), modelspace, layer, sign_origin_x, sign_origin_y)
+                else:
+                    mark.draw(value, modelspace, layer, sign_origin_x,
+                              sign_origin_y, sign_width, sign_height)
+
+
+# The values of all fields of a job as a table with a row per sign and a column per field. Fields can have
+# different amounts of values: the table has as many rows as the longest field, and a field that has run
+# out of values is None on the remaining rows, where its marks are not drawn.
+class SignTable:
+    def __init__(self, columns: Sequence[Column]) -> None:
+        self.columns = tuple(columns)
+        self.lengths = tuple(len(column) for column in self.columns)
+        self.rows = max(self.lengths, default=0)
+
+    # Values of all fields on the sign at the given index.
+    def row(self, index: int) -> Tuple[Optional[str], ...]:
+        return tuple(column[index] if index < length else None for column, length in zip(self.columns, self.lengths))
+
+    # Indices of the fields that have less values than there are signs.
+    @property
+    def short_columns(self) -> List[int]:
+        return [index for index, length in enumerate(self.lengths) if length < self.rows]
+
+
+# Sheet and sign dimensions and the grid layout derived from them.
+@dataclass(frozen=True)
+class Layout:
+    sheet_width: float = 300.0
+    sheet_height: float = 300.0
+    sign_width: float = 150.0
+    sign_height: float = 22.0
+    layers_per_sheet: int = 0
+
+    def __post_init__(self) -> None:
+        assert self.sign_width > 0, 'Sign width must be greater than 0.'
+        assert self.sign_height > 0, 'Sign height must be greater than 0.'
+        assert self.sheet_width >= self.sign_width, 'Sheet width must be greater than sign width.'
+        assert self.sheet_height >= self.sign_height, 'Sheet height must be greater than sign height.'
+        assert self.layers_per_sheet >= 0, 'Layers per sheet must not be negative.'
+
+    @property
+    def signs_per_row(self) -> int:
+        return int(self.sheet_width // self.sign_width)
+
+    @property
+    def signs_per_column(self) -> int:
+        return int(self.sheet_height // self.sign_height)
+
+    @property
+    def signs_per_layer(self) -> int:
+        return self.signs_per_row * self.signs_per_column
+
+    def total_layers(self, total_signs: int) -> int:
+        # Ceiling division.
+        return -int(-total_signs // self.signs_per_layer)
+
+    def total_sheets(self, total_signs: int) -> int:
+        if self.layers_per_sheet > 0:
+            return -int(-self.total_layers(total_signs) // self.layers_per_sheet)
+        return 1
+
+    # Index of the sheet the given layer is drawn on.
+    def sheet_index(self, layer: int) -> int:
+        if self.layers_per_sheet > 0:
+            return layer // self.layers_per_sheet
+        return 0
+
+    # Range of layers that are drawn on the given sheet.
+    def sheet_layers(self, sheet_index: int, total_signs: int) -> range:
+        total_layers = self.total_layers(total_signs)
+        if self.layers_per_sheet > 0:
+            start = sheet_index * self.layers_per_sheet
+            return range(start, min(start + self.layers_per_sheet, total_layers))
+        return range(total_layers)
+
+    # Range of sign indices that are drawn on the given sheet.
+    def sheet_signs(self, sheet_index: int, total_signs: int) -> range:
+        layers = self.sheet_layers(sheet_index, total_signs)
+        return range(min(layers.start * self.signs_per_layer, total_signs), min(layers.stop * self.signs_per_layer, total_signs))
+
+    # Origin (top left corner) of the sign at the given position of a layer.
+    def sign_origin(self, layer_position: int) -> Tuple[float, float]:
+        return (
+            (layer_position % self.signs_per_row) * self.sign_width,
+            -(layer_position // self.signs_per_row) * self.sign_height
+        )
+
+    # Left and top side bounds of a layer based on how many signs the layer will have.
+    def layer_outline(self, layer: int, total_signs: int) -> List[Tuple[float, float]]:
+        max_x = self.sign_width * self.signs_per_row
+        max_y = -self.sign_height * self.signs_per_column
+        if layer == self.total_layers(total_signs) - 1:  # If last layer.
+            signs_in_last_layer = total_signs - layer * self.signs_per_layer
+            if signs_in_last_layer < self.signs_per_row:
+                max_x = self.sign_width * signs_in_last_layer
+            max_y = self.sign_height * (-signs_in_last_layer // self.signs_per_row)
+        return [(0, max_y), (0, 0), (max_x, 0)]
+
+    # Right and bottom side bounds of a sign.
+    def sign_outline(self, sign_origin_x: float, sign_origin_y: float) -> List[Tuple[float, float]]:
+        return [
+            (sign_origin_x, sign_origin_y - self.sign_height),
+            (sign_origin_x + self.sign_width, sign_origin_y - self.sign_height),
+            (sign_origin_x + self.sign_width, sign_origin_y)
+        ]
+
+    # Print a summary of the layout.
+    def describe(self, total_signs: int) -> None:
+        total_layers = self.total_layers(total_signs)
+        print(f'Marking total of {total_signs} signs ({self.sign_width} x {self.sign_height}).')
+        print(f'Sheet size of {self.sheet_width} x {self.sheet_height} fits {self.signs_per_row} x {self.signs_per_column} signs,')
+        print(f'so the effective sheet size is {self.signs_per_row * self.sign_width} x {self.signs_per_column * self.sign_height}.')
+        print(f'Total of {total_layers} layer(s) are needed.')
+        if self.layers_per_sheet == 0:
+            print('There is no limit on the maximum amount of layers per sheet,')
+        else:
+            print(f'There are maximum of {self.layers_per_sheet} layer(s) per sheet,')
+        print(f'so total of {self.total_sheets(total_signs)} sheet(s) are needed.')
+
+
+# Packing signs onto the layers with the nesting optimizer instead of the fixed grid. Sizes are per sign
+# (width, height); signs without a size use the sign size of the layout.
+@dataclass(frozen=True)
+class Nesting:
+    sizes: Tuple[Tuple[float, float], ...] = ()
+    rotate: bool = False
+
+    def __post_init__(self) -> None:
+        for index, (width, height) in enumerate(self.sizes):
+            assert width > 0 and height > 0, f'Size of sign {index + 1} must be greater than 0.'
+
+
+# Per-sign sizes from columns of widths and heights. Empty values are replaced by the default size.
+def sign_sizes(widths: Sequence[Any], heights: Sequence[Any], default_width: float, default_height: float) -> Tuple[Tuple[float, float], ...]:
+    sizes = []
+    for index in range(max(len(widths), len(heights))):
+        width = widths[index] if index < len(widths) else None
+        height = heights[index] if index < len(heights) else None
+        sizes.append((
+            default_width if width in ('', None) else float(width),
+            default_height if height in ('', None) else float(height)
+        ))
+    return tuple(sizes)
+
+
+# Everything needed to generate the sheets of one job.
+@dataclass(frozen=True)
+class Job:
+    # Which repeated geometry is defined once per sheet as a block: nothing, each distinct QR code or each distinct sign body.
+    BLOCK_OPTIONS = ('NONE', 'QR', 'SIGN')
+    # How the sheets are written: through ezdxf's object model or by streaming the entities directly.
+    BACKEND_OPTIONS = ('EZDXF', 'DIRECT')
+
+    layout: Layout = field(default_factory=Layout)
+    fields: Tuple[FieldSpec, ...] = ()
+    dxf_version: str = DXF_VERSIONS[0]
+    blocks: str = 'NONE'
+    nesting: Optional[Nesting] = None
+    backend: str = 'EZDXF'
+    optimize_cuts: bool = False
+    binary: bool = False
+
+    def __post_init__(self) -> None:
+        assert self.dxf_version in DXF_VERSIONS, f'Unsupported DXF version {self.dxf_version}.'
+        assert self.blocks in Job.BLOCK_OPTIONS, f'Unknown block option {self.blocks}.'
+        assert self.backend in Job.BACKEND_OPTIONS, f'Unknown backend {self.backend}.'
+
+    # Values of the fields as one table. Built once per job.
+    @cached_property
+    def table(self) -> SignTable:
+        return SignTable([field_spec.values for field_spec in self.fields])
+
+    # Values of all fields on the sign at the given index (None for fields with less values).
+    def sign_values(self, sign_index: int) -> Tuple[Optional[str], ...]:
+        return self.table.row(sign_index)
+
+    # Length of the longest field (some fields can have less values than others).
+    @property
+    def total_signs(self) -> int:
+        return self.table.rows
+
+    # Size (width, height) of the sign at the given index.
+    def sign_size(self, sign_index: int) -> Tuple[float, float]:
+        if self.nesting is not None and sign_index < len(self.nesting.sizes):
+            return self.nesting.sizes[sign_index]
+        return self.layout.sign_width, self.layout.sign_height
+
+    # Widths and heights of all signs as arrays.
+    def sign_size_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        widths = np.full(self.total_signs, self.layout.sign_width)
+        heights = np.full(self.total_signs, self.layout.sign_height)
+        if self.nesting is not None:
+            sizes = np.array(self.nesting.sizes, dtype=float).reshape(-1, 2)[:self.total_signs]
+            widths[:len(sizes)] = sizes[:, 0]
+            heights[:len(sizes)] = sizes[:, 1]
+        return widths, heights
+
+    # Placements of the signs if nesting is used. Computed once per job.
+    @cached_property
+    def plan(self) -> Optional[NestingPlan]:
+        if self.nesting is None:
+            return None
+        layout = self.layout
+        return nest([self.sign_size(sign_index) for sign_index in range(self.total_signs)],
+                    layout.sheet_width, layout.sheet_height, self.nesting.rotate)
+
+    @property
+    def total_layers(self) -> int:
+        if self.plan is not None:
+            return len(self.plan.layers)
+        return self.layout.total_layers(self.total_signs)
+
+    @property
+    def total_sheets(self) -> int:
+        if self.plan is None:
+            return self.layout.total_sheets(self.total_signs)
+        if self.layout.layers_per_sheet > 0:
+            return -int(-self.total_layers // self.layout.layers_per_sheet)
+        return 1
+
+    # Range of layers that are drawn on the given sheet.
+    def sheet_layers(self, sheet_index: int) -> range:
+        if self.plan is None:
+            return self.layout.sheet_layers(sheet_index, self.total_signs)
+        layers_per_sheet = self.layout.layers_per_sheet
+        if layers_per_sheet > 0:
+            start = sheet_index * layers_per_sheet
+            return range(start, min(start + layers_per_sheet, self.total_layers))
+        return range(self.total_layers)
+
+    # Placements of the signs on the given layer (top left corners with y pointing down), from the nesting
+    # plan or the grid. Drawing and the preview both place signs with these.
+    def layer_placements(self, layer: int) -> Tuple[Placement, ...]:
+        if self.plan is not None:
+            return self.plan.layers[layer]
+        layout = self.layout
+        first_sign = layer * layout.signs_per_layer
+        placements = []
+        for sign_index in range(first_sign, min(first_sign + layout.signs_per_layer, self.total_signs)):
+            sign_origin_x, sign_origin_y = layout.sign_origin(sign_index - first_sign)
+            placements.append(Placement(sign_index, sign_origin_x, -sign_origin_y, layout.sign_width, layout.sign_height))
+        return tuple(placements)
+
+    # Number of signs drawn on the given sheet.
+    def sheet_sign_count(self, sheet_index: int) -> int:
+        if self.plan is None:
+            return len(self.layout.sheet_signs(sheet_index, self.total_signs))
+        return sum(len(self.plan.layers[layer]) for layer in self.sheet_layers(sheet_index))
+
+    # Sign indices drawn on the given sheet as sorted (start, stop) ranges. Grid sheets hold one range,
+    # nested sheets can hold several.
+    def sheet_sign_ranges(self, sheet_index: int) -> List[Tuple[int, int]]:
+        if self.plan is None:
+            signs = self.layout.sheet_signs(sheet_index, self.total_signs)
+            return [(signs.start, signs.stop)] if signs else []
+        ranges: List[Tuple[int, int]] = []
+        for sign_index in sorted(placement.sign_index for layer in self.sheet_layers(sheet_index)
+                                 for placement in self.plan.layers[layer]):
+            if ranges and ranges[-1][1] == sign_index:
+                ranges[-1] = (ranges[-1][0], sign_index + 1)
+            else:
+                ranges.append((sign_index, sign_index + 1))
+        return ranges
+
+    # Print a summary of the layout.
+    def describe(self) -> None:
+        for index in self.table.short_columns:
+            print(f'Field {index + 1} has only {self.table.lengths[index]} value(s), the remaining signs are drawn without its marks.')
+        if self.plan is None:
+            self.layout.describe(self.total_signs)
+            return
+        layout = self.layout
+        sizes = len(set(map(self.sign_size, range(self.total_signs))))
+        rotation = ' with rotation' if self.nesting.rotate else ''
+        print(f'Nesting total of {self.total_signs} signs of {sizes} size(s){rotation} on {layout.sheet_width} x {layout.sheet_height} layers.')
+        print(f'Total of {self.total_layers} layer(s) are needed, {self.plan.utilization:.1%} of their area is used.')
+        if layout.layers_per_sheet == 0:
+            print('There is no limit on the maximum amount of layers per sheet,')
+        else:
+            print(f'There are maximum of {layout.layers_per_sheet} layer(s) per sheet,')
+        print(f'so total of {self.total_sheets} sheet(s) are needed.')
+
+
+# Mark of a field that can not be drawn on some of the signs (indices into the job).
+@dataclass(frozen=True)
+class Problem:
+    field_index: int
+    mark: str
+    message: str
+    signs: Tuple[int, ...]
+
+    def __str__(self) -> str:
+        return f'Field {self.field_index + 1} {self.mark}: {self.message} on sign(s) {number_ranges(self.signs)}.'
+
+
+# Indices as numbers from 1 with consecutive ones joined into ranges, e.g. "1-4, 9".
+def number_ranges(indices: Sequence[int]) -> str:
+    ranges: List[List[int]] = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+    return ', '.join(str(start + 1) if stop == start + 1 else f'{start + 1}-{stop}' for start, stop in ranges)
+
+
+# Check all values and mark settings of a job before anything is drawn and return every problem found.
+# Each mark is checked against all of its field's values and signs at once, so a bad value is found in
+# milliseconds instead of stopping the drawing when its sign is reached.
+def validate(job: Job) -> List[Problem]:
+    widths, heights = job.sign_size_arrays()
+    problems = []
+    for field_index, field_spec in enumerate(job.fields):
+        rows = len(field_spec.values)
+        for mark in field_spec.marks:
+            for message, bad in mark.check(field_spec.values, widths[:rows], heights[:rows]):
+                signs = np.flatnonzero(bad)
+                if len(signs):
+                    problems.append(Problem(field_index, MARK_NAMES[type(mark)], message, tuple(signs.tolist())))
+    return problems
+
+
+# Draw all layers and signs of a single sheet. Grid layers share their outlines between neighbouring signs;
+# nested layers are outlined with merged cut lines and rotated signs are placed as rotated sign blocks.
+# If cuts are optimized, the lines, polylines and circles drawn on the modelspace are held back and drawn
+# at the end, each layer's in the order that minimizes travel, and the estimated lengths are counted.
+def render_sheet(job: Job, sheet_index: int, progress: Optional[Callable[[int], None]] = None, cancel: Optional[threading.Event] = None, metrics: Metrics = DISABLED) -> Union[ezdxf.drawing.Drawing, DirectSheet]:
+    layout = job.layout
+    total_signs = job.total_signs
+    plan = job.plan
+    table = job.table
+
+    sheet = DirectSheet(job.dxf_version) if job.backend == 'DIRECT' else ezdxf.new(job.dxf_version)
+    modelspace = metrics.wrap(sheet.modelspace())
+    if job.optimize_cuts:
+        modelspace = CutCollector(modelspace)
+    blocks = BlockCache(sheet, metrics) if job.blocks != 'NONE' else None
+    sign_blocks = blocks or BlockCache(sheet, metrics)
+    layers = job.sheet_layers(sheet_index)
+
+    # Encode the QR codes of the sheet in bulk before drawing, as long as they all fit in the caches.
+    with metrics.stage('QR'):
+        sign_ranges = job.sheet_sign_ranges(sheet_index)
+        for field_spec in job.fields:
+            qr_marks = [mark for mark in field_spec.marks if isinstance(mark, QRSpec)]
+            if not qr_marks:
+                continue
+            column = field_spec.values
+            values = {column[index] for start, stop in sign_ranges for index in range(start, min(stop, len(column)))}
+            if len(values) <= QR_CACHE_SIZE:
+                for mark in qr_marks:
+                    encode_column(list(values), mark.error, mark.geometry)
+
+    # Draw marks (QR, Text and Hole objects) of a single sign from its row of the sign table.
+    def draw_marks(sign_index: int, layer_name: str, sign_origin_x: float, sign_origin_y: float, rotation: float = 0.0) -> None:
+        sign_width, sign_height = job.sign_size(sign_index)
+        row = table.row(sign_index)
+        if job.blocks == 'SIGN' or rotation:
+            def draw_sign(block: Any) -> None:
+                for field_spec, value in zip(job.fields, row):
+                    if value is not None:
+                        field_spec.draw(value, block, '0', 0.0,
+                                        0.0, sign_width, sign_height, metrics=metrics)
+            sign_blocks.insert(('SIGN', sign_width, sign_height) + row, draw_sign,
+                               modelspace, layer_name, sign_origin_x, sign_origin_y, rotation)
+        else:
+            for field_spec, value in zip(job.fields, row):
+                if value is not None:
+                    field_spec.draw(value, modelspace, layer_name,
+                                    sign_origin_x, sign_origin_y, sign_width, sign_height, blocks, metrics)
+
+    # Report progress with the number of signs drawn so far and stop if cancelled.
+    def sign_done(signs_done: int) -> None:
+        if progress:
+            progress(signs_done)
+        if cancel is not None and cancel.is_set():
+            raise Cancelled('Cancelled.')
+
+    # Nested layers, and grid layers when cuts are optimized, are outlined with merged cut lines.
+    merged = plan is not None or job.optimize_cuts
+    if merged:
+        with metrics.stage('outlines'):
+            for layer in layers:
+                for (start_x, start_y), (end_x, end_y) in cut_lines(job.layer_placements(layer)):
+                    modelspace.add_lwpolyline([(start_x, -start_y), (end_x, -end_y)], dxfattribs={'layer': str(layer)})
+    else:
+        # Draw layer outlines (left and top side bounds) based on how many signs each layer will have.
+        with metrics.stage('outlines'):
+            for layer in layers:
+                modelspace.add_lwpolyline(layout.layer_outline(
+                    layer, total_signs), dxfattribs={'layer': str(layer)})
+
+    if plan is not None:
+        signs_done = sum(len(placements) for placements in plan.layers[:layers.start])
+    else:
+        signs_done = min(layers.start * layout.signs_per_layer, total_signs)
+    for layer in layers:
+        layer_name = str(layer)
+        for placement in job.layer_placements(layer):
+            if placement.rotated:
+                # Rotated 90 degrees counterclockwise around the bottom left corner of the placement.
+                draw_marks(placement.sign_index, layer_name, placement.x, -placement.y - placement.height, 90.0)
+            else:
+                draw_marks(placement.sign_index, layer_name, placement.x, -placement.y)
+            if not merged:
+                # Draw sign outline (right and bottom side bounds).
+                with metrics.stage('outlines'):
+                    modelspace.add_lwpolyline(layout.sign_outline(
+                        placement.x, -placement.y), dxfattribs={'layer': layer_name})
+            signs_done += 1
+            sign_done(signs_done)
+
+    if job.optimize_cuts:
+        with metrics.stage('cuts'):
+            cut, unordered, ordered = modelspace.flush()
+        metrics.count('cut length', round(cut))
+        metrics.count('travel length', round(ordered))
+        metrics.count('unordered travel length', round(unordered))
+    return sheet
+
+
+# Path of a sheet file inside an output directory.
+def sheet_path(directory: Union[str, Path], sheet_index: int) -> Path:
+    return Path(directory) / f'sheet{sheet_index}.dxf'
+
+
+# Paths the sheets are saved to: a single file or, if there are multiple sheets or output is a directory, files in a directory.
+def output_paths(total_sheets: int, output: Union[str, Path]) -> List[Path]:
+    output = Path(output)
+    if total_sheets == 1 and not output.is_dir():
+        return [output]
+    output.mkdir(parents=True, exist_ok=True)
+    return [sheet_path(output, index) for index in range(total_sheets)]
+
+
+# SHA-256 digest of a file's content, read again only when its size or modification time changes.
+def file_digest(path: Union[str, Path]) -> str:
+    stat = os.stat(path)
+    return cached_file_digest(os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=None)
+def cached_file_digest(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Mark settings as hashed. A font is identified by the digest of its file instead of its path, so the hash
+# does not depend on where the job was started from but changes when the font file is replaced.
+def mark_key(mark: MarkSpec) -> Any:
+    if getattr(mark, 'font', ''):
+        return type(mark).__name__, tuple({**asdict(mark), 'font': file_digest(mark.font)}.items())
+    return mark
+
+
+# Content hash of a sheet covering everything its drawing depends on: the job settings, the mark settings
+# of every field and the position, size and values of each sign on the sheet. The backend is left out
+# because both backends write the same content.
+def sheet_hash(job: Job, sheet_index: int) -> str:
+    digest = hashlib.sha256(repr((
+        MANIFEST_VERSION, job.dxf_version, job.binary, job.blocks, job.layout, job.optimize_cuts,
+        job.nesting.rotate if job.nesting is not None else None,
+        tuple(tuple(map(mark_key, field_spec.marks)) for field_spec in job.fields)
+    )).encode())
+    total_signs = job.total_signs
+    for layer in job.sheet_layers(sheet_index):
+        if job.plan is not None:
+            for placement in job.plan.layers[layer]:
+                digest.update(repr((layer, placement, job.sign_size(placement.sign_index),
+                                    job.sign_values(placement.sign_index))).encode())
+        else:
+            digest.update(repr((layer, job.layout.layer_outline(layer, total_signs))).encode())
+            signs_per_layer = job.layout.signs_per_layer
+            for sign_index in range(layer * signs_per_layer, min((layer + 1) * signs_per_layer, total_signs)):
+                digest.update(repr((sign_index, job.sign_values(sign_index))).encode())
+    return digest.hexdigest()
+
+
+# Manifest of an output: inside the output directory or next to a single output file.
+def manifest_path(output: Union[str, Path]) -> Path:
+    output = Path(output)
+    if output.is_dir():
+        return output / MANIFEST_NAME
+    return output.with_name(output.name + '.manifest.json')
+
+
+# Sheets of a manifest as {file name: {"hash": ..., "size": ...}}. Missing or unreadable manifests are empty.
+def load_manifest(path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict) or manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('sheets', {})
+
+
+def save_manifest(path: Path, sheets: Dict[str, Dict[str, Any]]) -> None:
+    temporary_path = path.with_name(path.name + '.tmp')
+    with open(temporary_path, 'w', encoding='utf-8') as file:
+        json.dump({'version': MANIFEST_VERSION, 'sheets': sheets}, file, indent=4)
+    os.replace(temporary_path, path)
+
+
+# Job manifest fixing the layout settings and the sheets of a job: the file name, sign index ranges and
+# content hash of every sheet. Runs producing different sheets of the same job (on other machines or
+# after a crash) check their job against it, so every sheet file ends up with the same name and content
+# whoever produced it.
+def job_manifest(job: Job) -> Dict[str, Any]:
+    return {
+        'version': JOB_MANIFEST_VERSION,
+        'dxf_version': job.dxf_version,
+        'layout': asdict(job.layout),
+        'nesting': job.nesting is not None,
+        'total_signs': job.total_signs,
+        'sheets': [{'name': sheet_path('.', sheet_index).name,
+                    'signs': [list(signs) for signs in job.sheet_sign_ranges(sheet_index)],
+                    'hash': sheet_hash(job, sheet_index)}
+                   for sheet_index in range(job.total_sheets)]
+    }
+
+
+# Write the job manifest to a file, or if the file exists, check that the job still matches it.
+def check_job_manifest(job: Job, path: Union[str, Path]) -> None:
+    manifest = job_manifest(job)
+    path = Path(path)
+    if not path.exists():
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=4)
+        return
+    with open(path, encoding='utf-8') as file:
+        expected = json.load(file)
+    assert expected.get('version') == JOB_MANIFEST_VERSION, f'Unsupported job manifest version in {path}.'
+    settings = [key for key in manifest if key != 'sheets' and expected.get(key) != manifest[key]]
+    assert not settings, f'Job does not match the job manifest {path}, its {", ".join(settings)} changed.'
+    expected_sheets = expected.get('sheets', [])
+    assert len(expected_sheets) == len(manifest['sheets']), \
+        f'Job does not match the job manifest {path}, it has {len(manifest["sheets"])} sheets instead of {len(expected_sheets)}.'
+    changed = [sheet['name'] for expected_sheet, sheet in zip(expected_sheets, manifest['sheets']) if expected_sheet != sheet]
+    assert not changed, f'Job does not match the job manifest {path}, the signs or values of {", ".join(changed)} have changed.'
+
+
+# Sheet indices from a list such as "0-3,7" (inclusive ranges).
+def parse_sheets(text: str, total_sheets: int) -> List[int]:
+    sheets = set()
+    for part in text.split(','):
+        first, _, last = part.strip().partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        assert 0 <= first <= last < total_sheets, f'Sheet(s) {part.strip()} must be between 0 and {total_sheets - 1}.'
+        sheets.update(range(first, last + 1))
+    return sorted(sheets)
+
+
+# Sheet indices of shard "K/N": the sheets are split into N consecutive runs of nearly equal length and
+# the Kth (1 to N) is taken.
+def shard_sheets(text: str, total_sheets: int) -> List[int]:
+    shard, _, shards = text.partition('/')
+    shard, shards = int(shard), int(shards)
+    assert 1 <= shard <= shards, f'Shard {text} must be K/N with K between 1 and N.'
+    return list(range((shard - 1) * total_sheets // shards, shard * total_sheets // shards))
+
+
+# Indices of the sheets that have to be drawn again: the ones whose hash differs from the manifest or
+# whose file is missing or has changed size.
+def changed_sheets(paths: Sequence[Path], hashes: Sequence[str], manifest: Dict[str, Dict[str, Any]]) -> List[int]:
+    changed = []
+    for sheet_index, (path, sheet_hash) in enumerate(zip(paths, hashes)):
+        entry = manifest.get(path.name)
+        if entry is None or entry.get('hash') != sheet_hash or not path.exists() or path.stat().st_size != entry.get('size'):
+            changed.append(sheet_index)
+    return changed
+
+
+# Write a drawn sheet to a file, as binary DXF if the job asks for it, and return the number of signs on
+# it. The sheet is written to a temporary file next to its path first, so a failure never leaves a
+# truncated sheet behind.
+def write_sheet(job: Job, sheet_index: int, sheet: Union[ezdxf.drawing.Drawing, DirectSheet], path: Path, metrics: Metrics = DISABLED) -> int:
+    temporary_path = path.with_name(path.name + '.tmp')
+    try:
+        with metrics.stage('save'):
+            sheet.saveas(temporary_path, fmt='bin' if job.binary else 'asc')
+            os.replace(temporary_path, path)
+    finally:
+        if isinstance(sheet, DirectSheet):
+            sheet.close()
+        if temporary_path.exists():
+            temporary_path.unlink()
+    signs = job.sheet_sign_count(sheet_index)
+    metrics.count('sheets')
+    metrics.count('signs', signs)
+    return signs
+
+
+# Draw and save a single sheet, returning the number of signs on it.
+def save_sheet(job: Job, sheet_index: int, path: Path, progress: Optional[Callable[[int], None]] = None, cancel: Optional[threading.Event] = None, metrics: Metrics = DISABLED) -> int:
+    sheet = render_sheet(job, sheet_index, progress, cancel, metrics)
+    return write_sheet(job, sheet_index, sheet, path, metrics)
+
+
+# Job and cancel event of a worker process, sent once by the pool initializer so that only the sheet
+# index and path are sent for each sheet.
+worker_job = None
+worker_cancel = None
+
+
+def init_worker(job: Job, cancel: multiprocessing.synchronize.Event) -> None:
+    global worker_job, worker_cancel
+    worker_job = job
+    worker_cancel = cancel
+
+
+# Draw and save a single sheet of the worker's job in a worker process. Returns the number of signs and,
+# if metrics are collected, the metrics report of the sheet.
+def save_sheet_in_worker(sheet_index: int, path: Path, collect_metrics: bool = False) -> Tuple[int, Optional[Dict[str, Any]]]:
+    metrics = Metrics() if collect_metrics else DISABLED
+    signs = save_sheet(worker_job, sheet_index, path, cancel=worker_cancel, metrics=metrics)
+    return signs, metrics.report() if collect_metrics else None
+
+
+# Zip archive the sheets are packed into as they are saved. Sheets are first written to a staging
+# directory next to the archive and moved into it one at a time, so sheets saved by several threads or
+# processes can be added as they finish.
+class SheetArchive:
+    def __init__(self, path: Path, total_sheets: int) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.staging = tempfile.TemporaryDirectory(dir=path.parent)
+        self.paths = [sheet_path(self.staging.name, index) for index in range(total_sheets)]
+        self.file = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self.lock = threading.Lock()
+
+    def add(self, sheet_index: int) -> None:
+        path = self.paths[sheet_index]
+        with self.lock:
+            self.file.write(path, path.name)
+        path.unlink()
+
+    # Finish the archive with the sheets added so far.
+    def close(self) -> None:
+        self.file.close()
+        self.staging.cleanup()
+
+
+# Create and save all sheets of a job. Sheets are streamed: each one is saved and freed as soon as its
+# last layer is drawn, so memory use stays at a few sheets and sheets written before a failure are kept.
+# With one worker the sheets are drawn one after another while a pool of threads saves the previously
+# drawn ones. Sheets share no state, so with more than one worker each sheet is drawn and saved in its
+# own process. The files are named and filled the same way in both cases. If output is a .zip file the
+# sheets are packed into it instead of being saved as separate files. Progress callback is called with
+# the number of signs drawn so far. Setting the cancel event stops the job by raising Cancelled. Stage
+# times of worker processes and threads are added up in the metrics, so they can exceed the total time.
+# In incremental mode (or if the output already has a manifest) the content hash and size of every saved
+# sheet are kept in a manifest, and only sheets whose hash changed or whose file is missing are drawn
+# again. Sheet files of an earlier run that are no longer part of the job are removed. The manifest is
+# saved after every sheet, so an interrupted run can be resumed incrementally. If sheets are given only
+# those sheets are drawn (keeping their names and a manifest), which lets a job be split across runs.
+def generate(job: Job, output: Union[str, Path], workers: int = 1, progress: Optional[Callable[[int], None]] = None, cancel: Optional[threading.Event] = None, metrics: Metrics = DISABLED, incremental: bool = False, sheets: Optional[Sequence[int]] = None) -> List[Path]:
+    with metrics.stage('layout'):
+        total_sheets = job.total_sheets
+    archive = None
+    if Path(output).suffix.lower() == '.zip':
+        assert not incremental, 'Incremental runs need a directory or a .dxf file as output, not a .zip archive.'
+        archive = SheetArchive(Path(output), total_sheets)
+        paths = archive.paths
+        track = False
+    else:
+        paths = output_paths(total_sheets, output)
+        manifest_file = manifest_path(output)
+        track = incremental or sheets is not None or manifest_file.exists()
+    selected = list(range(len(paths))) if sheets is None else sorted(set(sheets))
+    assert all(0 <= sheet_index < len(paths) for sheet_index in selected), f'Job has only {len(paths)} sheet(s).'
+    sheets = selected
+    if track:
+        hashes = [sheet_hash(job, sheet_index) for sheet_index in range(len(paths))]
+        manifest = load_manifest(manifest_file)
+        if incremental:
+            changed = set(changed_sheets(paths, hashes, manifest))
+            sheets = [sheet_index for sheet_index in selected if sheet_index in changed]
+        names = {path.name for path in paths}
+        for name in manifest:
+            if name not in names and (manifest_file.parent / name).exists():
+                (manifest_file.parent / name).unlink()
+        # Sheets that are not drawn keep their entries, as long as they are still part of the job.
+        saved = {name: entry for name, entry in manifest.items() if name in names}
+        for sheet_index in sheets:
+            saved.pop(paths[sheet_index].name, None)
+        metrics.count('unchanged sheets', len(selected) - len(sheets))
+
+    # Keep the hash and size of a saved sheet in the manifest, which is saved right away as a checkpoint.
+    def record(sheet_index: int) -> None:
+        if track:
+            saved[paths[sheet_index].name] = {'hash': hashes[sheet_index], 'size': paths[sheet_index].stat().st_size}
+            save_manifest(manifest_file, saved)
+
+    # Write a drawn sheet in a saving thread.
+    def write_and_store(sheet_index: int, sheet: Union[ezdxf.drawing.Drawing, DirectSheet]) -> None:
+        write_sheet(job, sheet_index, sheet, paths[sheet_index], metrics)
+        if archive is not None:
+            archive.add(sheet_index)
+
+    try:
+        workers = min(workers or os.cpu_count() or 1, len(sheets))
+        if workers <= 1:
+            # At most SAVE_THREADS drawn sheets wait to be saved at a time, which keeps memory use bounded.
+            with ThreadPoolExecutor(SAVE_THREADS) as savers:
+                saving = {}
+                try:
+                    for sheet_index in sheets:
+                        sheet = render_sheet(job, sheet_index, progress, cancel, metrics)
+                        saving[savers.submit(write_and_store, sheet_index, sheet)] = sheet_index
+                        if len(saving) >= SAVE_THREADS:
+                            done, _ = wait(saving, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                future.result()
+                                record(saving.pop(future))
+                finally:
+                    # Sheets drawn before a failure are still saved.
+                    wait(saving)
+                    for future, sheet_index in saving.items():
+                        if future.exception() is None:
+                            record(sheet_index)
+                for future in saving:
+                    future.result()
+            return [Path(output)] if archive is not None else [paths[sheet_index] for sheet_index in selected]
+
+        # Cancellation is passed on to the worker processes through an event of their own.
+        workers_cancel = multiprocessing.Event()
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(job, workers_cancel)) as executor:
+            pending = {executor.submit(save_sheet_in_worker, sheet_index, paths[sheet_index], metrics.enabled): sheet_index
+                       for sheet_index in sheets}
+            sheet_indices = dict(pending)
+            signs_done = sum(job.sheet_sign_count(sheet_index) for sheet_index in set(range(len(paths))) - set(sheets))
+            try:
+                while pending:
+                    done, pending = wait(pending, None if cancel is None else CANCEL_POLL_INTERVAL, FIRST_COMPLETED)
+                    for future in done:
+                        signs, report = future.result()
+                        if archive is not None:
+                            archive.add(sheet_indices[future])
+                        record(sheet_indices[future])
+                        signs_done += signs
+                        if report is not None:
+                            metrics.merge(report)
+                        if progress:
+                            progress(signs_done)
+                    if cancel is not None and cancel.is_set():
+                        raise Cancelled('Cancelled.')
+            except BaseException:
+                workers_cancel.set()
+                for future in pending:
+                    future.cancel()
+                raise
+        return [Path(output)] if archive is not None else [paths[sheet_index] for sheet_index in selected]
+    finally:
+        # Sheets saved before a failure are kept in the manifest or the archive.
+        if track:
+            save_manifest(manifest_file, saved)
+        if archive is not None:
+            archive.close()
+
+
+# Estimated cut and travel lengths counted while drawing a job with optimized cuts.
+def cut_summary(metrics: Metrics) -> str:
+    counts = metrics.counts
+    return (f'Estimated cut length {counts.get("cut length", 0) / 1000:.1f} m and travel {counts.get("travel length", 0) / 1000:.1f} m '
+            f'({counts.get("unordered travel length", 0) / 1000:.1f} m in drawing order).')
+
+
+# Build a mark spec from a job description entry such as {"type": "QR", "size": 20}. Relative font
+# paths are resolved against base directory.
+def mark_from_dict(description: Dict[str, Any], base_directory: Union[str, Path] = '.') -> MarkSpec:
+    description = dict(description)
+    mark_type = description.pop('type')
+    if description.get('font'):
+        description['font'] = str(Path(base_directory) / description['font'])
+    assert mark_type in MARK_TYPES, f'Unknown mark type {mark_type}.'
+    return MARK_TYPES[mark_type](**description)
+
+
+# Column slice (path, column, start row, end row) a field or nesting description reads the given column of.
+def column_source(description: Dict[str, Any], column_key: str, base_directory: Union[str, Path]) -> Tuple[Path, int, int, int]:
+    return (Path(base_directory) / description['path'], int(description.get(column_key, 1)),
+            int(description.get('start_row', 1)), int(description.get('end_row', 0)))
+
+
+# Read the values of column slices. The slices of the same spreadsheet are read together, so each file
+# is parsed at most once however many columns are read from it.
+def read_sources(sources: Sequence[Tuple[Path, int, int, int]]) -> Dict[Tuple[Path, int, int, int], List[Any]]:
+    slices: Dict[Path, List[Tuple[int, int, int]]] = {}
+    for path, *column_slice in dict.fromkeys(sources):
+        slices.setdefault(path, []).append(tuple(column_slice))
+    values = {}
+    for path, path_slices in slices.items():
+        for column_slice, column_values in zip(path_slices, read_columns(path, path_slices)):
+            values[(path, *column_slice)] = column_values
+    return values
+
+
+# Build a job from a job description. Relative field source paths are resolved against base directory.
+def job_from_dict(description: Dict[str, Any], base_directory: Union[str, Path] = '.') -> Job:
+    sheet = description.get('sheet', {})
+    sign = description.get('sign', {})
+    layout = Layout(
+        sheet_width=float(sheet.get('width', Layout.sheet_width)),
+        sheet_height=float(sheet.get('height', Layout.sheet_height)),
+        sign_width=float(sign.get('width', Layout.sign_width)),
+        sign_height=float(sign.get('height', Layout.sign_height)),
+        layers_per_sheet=int(sheet.get('layers', Layout.layers_per_sheet))
+    )
+    nesting_description = description.get('nesting', {})
+    sources = [column_source(field_description, 'column', base_directory)
+               for field_description in description.get('fields', []) if 'values' not in field_description]
+    if 'sizes' not in nesting_description and 'path' in nesting_description:
+        sources += [column_source(nesting_description, key, base_directory)
+                    for key in ('width_column', 'height_column') if key in nesting_description]
+    source_values = read_sources(sources)
+    fields = []
+    for field_description in description.get('fields', []):
+        if 'values' in field_description:
+            values = field_description['values']
+        else:
+            values = source_values[column_source(field_description, 'column', base_directory)]
+        marks = tuple(mark_from_dict(mark, base_directory)
+                      for mark in field_description.get('marks', []))
+        fields.append(FieldSpec(Column(values), marks))
+    nesting = None
+    if 'nesting' in description:
+        if 'sizes' in nesting_description:
+            sizes = tuple((float(width), float(height))
+                          for width, height in nesting_description['sizes'])
+        elif 'path' in nesting_description:
+            def column(key: str) -> List[Any]:
+                if key not in nesting_description:
+                    return []
+                return source_values[column_source(nesting_description, key, base_directory)]
+            sizes = sign_sizes(column('width_column'), column('height_column'),
+                               layout.sign_width, layout.sign_height)
+        else:
+            sizes = ()
+        nesting = Nesting(sizes, bool(nesting_description.get('rotate', False)))
+    return Job(layout, tuple(fields), description.get('dxf_version', DXF_VERSIONS[0]), description.get('blocks', 'NONE'), nesting,
+               description.get('backend', 'EZDXF'), bool(description.get('optimize_cuts', False)),
+               bool(description.get('binary', False)))
+
+
+# Load a job description (.json) file.
+def load_job(path: Union[str, Path]) -> Job:
+    path = Path(path)
+    with open(path, encoding='utf-8') as file:
+        return job_from_dict(json.load(file), path.parent)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Create sign marking .dxf files from a job description without a display.')
+    parser.add_argument('job', help='job description (.json) file')
+    parser.add_argument('-o', '--output', default='.',
+                        help='output .dxf file or directory for multiple sheets (default: current directory)')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='number of worker processes drawing sheets in parallel, 0 = one per CPU (default: 1)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only rewrite sheets whose signs or settings changed since the last run (keeps a manifest of the sheets)')
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('--sheets', help='only draw the given sheets, e.g. 0-3,7 (files keep the names of a full run)')
+    selection.add_argument('--shard', help='only draw shard K of N consecutive runs of sheets, given as K/N')
+    parser.add_argument('--job-manifest', help='job manifest (.json) file fixing the sheets and their signs; written if missing, '
+                                               'otherwise the job must match it')
+    parser.add_argument('--no-validate', action='store_true',
+                        help='draw even if some marks do not fit on their signs or values can not be encoded')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the time spent in each stage and the number of entities drawn')
+    parser.add_argument('--report', help='save the stage times and counts to a JSON file')
+    parser.add_argument('--profile', help='profile the run with cProfile and save the profile to a file (only the main process, use -j 1 to profile drawing)')
+    args = parser.parse_args(argv)
+
+    stats = args.stats or args.report or args.profile
+    metrics = Metrics(profile=bool(args.profile)) if stats else DISABLED
+    metrics.start()
+    try:
+        with metrics.stage('read'):
+            job = load_job(args.job)
+        with metrics.stage('layout'):
+            job.plan  # Nesting happens here.
+        if job.total_signs == 0:
+            print('No fields with data.')
+            return 1
+        sheets = None
+        if args.sheets:
+            sheets = parse_sheets(args.sheets, job.total_sheets)
+        elif args.shard:
+            sheets = shard_sheets(args.shard, job.total_sheets)
+        if args.job_manifest:
+            check_job_manifest(job, args.job_manifest)
+        with metrics.stage('validate'):
+            problems = validate(job)
+    except (OSError, ValueError, KeyError, TypeError, AssertionError) as e:
+        print(e)
+        return 1
+    for problem in problems:
+        print(problem)
+    if problems and not args.no_validate:
+        return 1
+
+    # The cut and travel lengths are counted in the metrics.
+    if job.optimize_cuts and not metrics.enabled:
+        metrics = Metrics()
+    job.describe()
+    if sheets is not None:
+        print(f'Drawing {len(sheets)} of the sheets.')
+    print('Drawing marks.')
+    try:
+        paths = generate(job, args.output, args.workers, metrics=metrics, incremental=args.incremental, sheets=sheets)
+    except Exception as e:
+        print(e)
+        return 1
+    metrics.stop()
+    for path in paths:
+        print(path)
+    print('Success.')
+    if job.optimize_cuts:
+        print(cut_summary(metrics))
+    if stats:
+        print(metrics.summary())
+    if args.report:
+        metrics.save(args.report)
+    if args.profile:
+        metrics.save_profile(args.profile)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
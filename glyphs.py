@@ -0,0 +1,142 @@
+'''
+KylttiMaker glyph outlines
+
+Turns text into closed polyline outlines read from a TrueType or OpenType font
+file, so text can be cut without the CAM software exploding TEXT entities or
+having the font installed. Each glyph is flattened once per font and size and
+kept in a cache; drawing a string only offsets the cached outlines. Text is
+laid out with the advance widths of the font (no kerning).
+'''
+
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+import numpy as np
+from fontTools.pens.basePen import BasePen
+from fontTools.ttLib import TTFont
+
+# Maximum distance (in drawing units) between a curve and the polyline that replaces it.
+CURVE_TOLERANCE = 0.01
+# Maximum amount of distinct glyph outlines kept in memory.
+GLYPH_CACHE_SIZE = 4096
+# Cap height relative to the em size for fonts that do not store one.
+DEFAULT_CAP_HEIGHT = 0.7
+
+
+# Pen that flattens the contours of a glyph into closed polylines, in font units scaled by the given factor.
+class FlatteningPen(BasePen):
+    def __init__(self, glyph_set: object, scale: float) -> None:
+        super().__init__(glyph_set)
+        self.scale = scale
+        self.contours: List[List[Tuple[float, float]]] = []
+        self.contour: List[Tuple[float, float]] = []
+
+    # Number of straight segments needed to keep the given curve within the tolerance.
+    def segments(self, control_polygon: np.ndarray, factor: float) -> int:
+        curvature = np.linalg.norm(np.diff(control_polygon, 2, axis=0), axis=1).max() * self.scale
+        return max(1, math.ceil(math.sqrt(factor * curvature / CURVE_TOLERANCE)))
+
+    def _moveTo(self, pt: Tuple[float, float]) -> None:
+        self.contour = [pt]
+
+    def _lineTo(self, pt: Tuple[float, float]) -> None:
+        self.contour.append(pt)
+
+    def _qCurveToOne(self, pt1: Tuple[float, float], pt2: Tuple[float, float]) -> None:
+        control_polygon = np.array((self._getCurrentPoint(), pt1, pt2), dtype=float)
+        p0, p1, p2 = control_polygon
+        t = np.linspace(0, 1, self.segments(control_polygon, 1 / 4) + 1)[1:, None]
+        self.contour.extend(map(tuple, (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2))
+
+    def _curveToOne(self, pt1: Tuple[float, float], pt2: Tuple[float, float], pt3: Tuple[float, float]) -> None:
+        control_polygon = np.array((self._getCurrentPoint(), pt1, pt2, pt3), dtype=float)
+        p0, p1, p2, p3 = control_polygon
+        t = np.linspace(0, 1, self.segments(control_polygon, 3 / 4) + 1)[1:, None]
+        self.contour.extend(map(tuple, (1 - t) ** 3 * p0 + 3 * (1 - t) ** 2 * t * p1 + 3 * (1 - t) * t ** 2 * p2 + t ** 3 * p3))
+
+    def _closePath(self) -> None:
+        if len(self.contour) > 2:
+            if self.contour[-1] != self.contour[0]:
+                self.contour.append(self.contour[0])
+            self.contours.append(self.contour)
+        self.contour = []
+
+    _endPath = _closePath
+
+
+# Font file with the metrics needed to place its glyphs.
+class Font:
+    def __init__(self, path: str) -> None:
+        self.font = TTFont(path, lazy=True)
+        self.glyph_set = self.font.getGlyphSet()
+        self.cmap = self.font.getBestCmap() or {}
+        self.units_per_em = self.font['head'].unitsPerEm
+        os2 = self.font['OS/2'] if 'OS/2' in self.font else None
+        self.cap_height = getattr(os2, 'sCapHeight', 0) or DEFAULT_CAP_HEIGHT * self.units_per_em
+        self.descender = self.font['hhea'].descent
+
+    def glyph_name(self, character: str) -> str:
+        return self.cmap.get(ord(character), '.notdef')
+
+
+@lru_cache(maxsize=None)
+def load_font(path: str) -> Font:
+    return Font(path)
+
+
+# Outline of a glyph at a text height: the advance width and the closed contours as read-only arrays
+# relative to the start of the glyph on the baseline.
+@dataclass(frozen=True)
+class Glyph:
+    advance: float
+    contours: Tuple[np.ndarray, ...]
+
+
+# Text height is the cap height, like the height of DXF TEXT entities.
+@lru_cache(maxsize=GLYPH_CACHE_SIZE)
+def glyph_outline(path: str, size: float, character: str) -> Glyph:
+    font = load_font(path)
+    scale = size / font.cap_height
+    glyph = font.glyph_set[font.glyph_name(character)]
+    pen = FlatteningPen(font.glyph_set, scale)
+    glyph.draw(pen)
+    contours = []
+    for contour in pen.contours:
+        points = np.array(contour, dtype=float) * scale
+        points.flags.writeable = False
+        contours.append(points)
+    return Glyph(glyph.width * scale, tuple(contours))
+
+
+# Offset of the start of the baseline from the alignment point for each of TextSpec.ALIGN_OPTIONS.
+def align_offset(align: str, width: float, size: float, descender: float) -> Tuple[float, float]:
+    vertical, horizontal = align.split('_')
+    x = {'LEFT': 0.0, 'CENTER': -width / 2, 'RIGHT': -width}[horizontal]
+    y = {'TOP': -size, 'MIDDLE': -size / 2, 'BOTTOM': -descender}[vertical]
+    return x, y
+
+
+# Rectangle (left, bottom, right, top) a text covers relative to its alignment point, from the advance
+# widths of its glyphs and the cap height.
+def text_box(path: str, size: float, text: str, align: str) -> Tuple[float, float, float, float]:
+    font = load_font(path)
+    width = sum(glyph_outline(path, size, character).advance for character in text)
+    x, y = align_offset(align, width, size, font.descender * size / font.cap_height)
+    return x, y, x + width, y + size
+
+
+# Closed outlines of a text as point lists, aligned at the given point the way a DXF TEXT entity would be.
+def text_outlines(path: str, size: float, text: str, align: str, x: float, y: float) -> List[List[Sequence[float]]]:
+    glyphs = [glyph_outline(path, size, character) for character in text]
+    font = load_font(path)
+    offset_x, offset_y = align_offset(align, sum(glyph.advance for glyph in glyphs),
+                                      size, font.descender * size / font.cap_height)
+    cursor = x + offset_x
+    baseline = y + offset_y
+    outlines = []
+    for glyph in glyphs:
+        for contour in glyph.contours:
+            outlines.append((contour + (cursor, baseline)).tolist())
+        cursor += glyph.advance
+    return outlines
@@ -11,14 +11,15 @@ the signs will be marked on and the program will automatically fit the data on
 the sheets. Each sheet (=file) can have multiple layers of signs.
 '''
 
-from pathlib import Path
-from typing import Union
-from tkinter import Tk, LEFT, RIGHT, BOTH, END, StringVar, BooleanVar, DoubleVar, IntVar, Menu, Event
+from typing import Tuple, Union
+from tkinter import Tk, LEFT, RIGHT, BOTH, Y, END, StringVar, BooleanVar, DoubleVar, IntVar, Menu, Event, Canvas
 from tkinter.ttk import Treeview, Progressbar, Button, Checkbutton, Entry, Frame, Label, LabelFrame, Spinbox, OptionMenu
 import tkinter.filedialog
-import ezdxf
-import xlrd
-import pyqrcode
+import threading
+from engine import DXF_VERSIONS, QRSpec, TextSpec, HoleSpec, Column, FieldSpec, Layout, Nesting, Job, cut_summary, generate, sign_sizes, validate
+from metrics import DISABLED, Metrics
+from preview import Scene
+from spreadsheet import read_column
 
 
 # QR code with relevant alignment options that can be drawn on a sheet.
@@ -28,6 +29,9 @@ class QR:
     DEFAULT_SIZE = 20.0
     DEFAULT_INVERSE = False
     DEFAULT_PADDING = 0.0
+    DEFAULT_GEOMETRY = 'MODULES'
+    DEFAULT_ERROR = 'H'
+    DEFAULT_MIN_MODULE = 0.25
 
     # Initialize a GUI frame where user can enter the relevant options.
     def __init__(self, properties: LabelFrame) -> None:
@@ -63,49 +67,40 @@ class QR:
         self.padding.set(QR.DEFAULT_PADDING)
         Spinbox(self.frame, to=App.MAX_SHEET_HEIGHT, textvariable=self.padding,
                 width=App.SPINBOX_WIDTH).grid(column=1, row=4, sticky='W')
-
-    # Draws the QR code on the sheet
-    def draw(self, value: str, sheet: ezdxf.drawing.Drawing, layer: int, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
-        position_x = float(self.position_x.get())
-        position_y = float(self.position_y.get())
-        size = float(self.size.get())
-        inverse = self.inverse.get()
-        padding = float(self.padding.get())
-
-        hatch = sheet.modelspace().add_hatch(
-            dxfattribs={'layer': str(layer), 'hatch_style': 1})
-
-        if inverse:
-            hatch.paths.add_polyline_path([
-                (sign_origin_x + position_x, sign_origin_y - position_y),
-                (sign_origin_x + position_x + size, sign_origin_y - position_y),
-                (sign_origin_x + position_x + size, sign_origin_y - position_y - size),
-                (sign_origin_x + position_x, sign_origin_y - position_y - size)
-            ])
-
-        # Gets the QR code as multi line string of ones and zeros
-        code = pyqrcode.create(value).text(quiet_zone=0)
-        lines = code.splitlines()
-        cell_size = (size - 2 * padding) / len(lines)
-
-        for y, line in enumerate(lines):
-            for x, char in enumerate(line):
-                if char == '1':
-                    hatch.paths.add_polyline_path([
-                        (sign_origin_x + position_x + padding + x * cell_size, sign_origin_y - position_y - padding - y * cell_size),
-                        (sign_origin_x + position_x + padding + (x + 1) * cell_size, sign_origin_y - position_y - padding - y * cell_size),
-                        (sign_origin_x + position_x + padding + (x + 1) * cell_size, sign_origin_y - position_y - padding - (y + 1) * cell_size),
-                        (sign_origin_x + position_x + padding + x * cell_size, sign_origin_y - position_y - padding - (y + 1) * cell_size)
-                    ])
+        Label(self.frame, text='Geometry').grid(
+            column=0, row=5, sticky='E', pady=App.PADDING)
+        self.geometry = StringVar(self.frame)
+        OptionMenu(self.frame, self.geometry, QR.DEFAULT_GEOMETRY,
+                   *QRSpec.GEOMETRY_OPTIONS).grid(column=1, row=5, sticky='W')
+        Label(self.frame, text='Error correction').grid(
+            column=0, row=6, sticky='E', pady=App.PADDING)
+        self.error = StringVar(self.frame)
+        OptionMenu(self.frame, self.error, QR.DEFAULT_ERROR,
+                   *QRSpec.ERROR_OPTIONS).grid(column=1, row=6, sticky='W')
+        Label(self.frame, text='Min module').grid(
+            column=0, row=7, sticky='E', pady=App.PADDING)
+        self.min_module = StringVar(self.frame)
+        self.min_module.set(QR.DEFAULT_MIN_MODULE)
+        Spinbox(self.frame, to=App.MAX_SHEET_HEIGHT, increment=0.05, textvariable=self.min_module,
+                width=App.SPINBOX_WIDTH).grid(column=1, row=7, sticky='W')
+
+    # Freeze the entered options into an immutable spec used by the engine.
+    def spec(self) -> QRSpec:
+        return QRSpec(
+            position_x=float(self.position_x.get()),
+            position_y=float(self.position_y.get()),
+            size=float(self.size.get()),
+            inverse=self.inverse.get(),
+            padding=float(self.padding.get()),
+            geometry=self.geometry.get(),
+            error=self.error.get(),
+            min_module=float(self.min_module.get())
+        )
 
 
 # Text object with a position, size and alignment options that can be drawn on a sheet.
 class Text:
-    ALIGN_OPTIONS = [
-        'TOP_LEFT', 'TOP_CENTER', 'TOP_RIGHT',
-        'MIDDLE_LEFT', 'MIDDLE_CENTER', 'MIDDLE_RIGHT',
-        'BOTTOM_LEFT', 'BOTTOM_CENTER', 'BOTTOM_RIGHT'
-    ]
+    ALIGN_OPTIONS = TextSpec.ALIGN_OPTIONS
 
     # Initialize a GUI frame where user can enter the relevant options.
     def __init__(self, properties: LabelFrame) -> None:
@@ -133,17 +128,27 @@ class Text:
         self.align = StringVar(self.frame)
         OptionMenu(self.frame, self.align,
                    Text.ALIGN_OPTIONS[4], *Text.ALIGN_OPTIONS).grid(column=1, row=3, sticky='W')
+        Label(self.frame, text='Font').grid(
+            column=0, row=4, sticky='E', pady=App.PADDING)
+        self.font = StringVar(self.frame)
+        Entry(self.frame, textvariable=self.font).grid(
+            column=1, row=4, sticky='WE')
+        Button(self.frame, text='Select', command=self.select,
+               width=5).grid(column=2, row=4, sticky='W')
 
-    def draw(self, value: str, sheet: ezdxf.drawing.Drawing, layer: int, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
-        size = float(self.size.get())
-        assert size >= 0, 'Font size must be positive.'
-        position = (
-            sign_origin_x + float(self.position_x.get()),
-            sign_origin_y - float(self.position_y.get())
+    # Get a font file from the user. Text is drawn as outlines of the font's glyphs instead of a TEXT entity.
+    def select(self) -> None:
+        if dialog_path := tkinter.filedialog.askopenfilename(filetypes=(('Fonts', '*.ttf *.otf'), ('All files', '*.*'))):
+            self.font.set(dialog_path)
+
+    def spec(self) -> TextSpec:
+        return TextSpec(
+            position_x=float(self.position_x.get()),
+            position_y=float(self.position_y.get()),
+            size=float(self.size.get()),
+            align=self.align.get(),
+            font=self.font.get()
         )
-        align = self.align.get()
-        sheet.modelspace().add_text(value, dxfattribs={'layer': str(
-            layer), 'height': size}).set_pos(position, align=align)
 
 
 # A hole with a position and size that can be drawn on a sheet.
@@ -173,17 +178,18 @@ class Hole:
         Spinbox(self.frame, to=App.MAX_SHEET_HEIGHT, textvariable=self.diameter,
                 width=App.SPINBOX_WIDTH).grid(column=1, row=2, sticky='W')
 
-    def draw(self, value: str, sheet: ezdxf.drawing.Drawing, layer: int, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
-        x = (sign_origin_x + float(self.position_x.get()))
-        y = (sign_origin_y - float(self.position_y.get()))
-        r = float(self.diameter.get()) / 2
-        assert r >= 0, 'Diameter must be positive.'
-        sheet.modelspace().add_circle(
-            (x, y), r, dxfattribs={'layer': str(layer)})
+    def spec(self) -> HoleSpec:
+        return HoleSpec(
+            position_x=float(self.position_x.get()),
+            position_y=float(self.position_y.get()),
+            diameter=float(self.diameter.get())
+        )
+
 
 # A class that represents a collection of text data that get's read from a file and marked on a sign as for example a QR code or a simple text.
 class Field:
     MAX_COLUMN = MAX_ROW = 100000
+    SIZE_OPTIONS = ('NONE', 'WIDTH', 'HEIGHT')  # Whether the values are sign sizes used by nesting.
 
     # Initialize GUI for the user to enter field properties.
     def __init__(self, properties: LabelFrame) -> None:
@@ -224,37 +230,130 @@ class Field:
         self.values_amount.set(0)
         Label(self.frame, textvariable=self.values_amount).grid(
             column=3, row=4, sticky='W')
+        Label(self.frame, text='Sign size').grid(
+            column=0, row=5, sticky='E', pady=App.PADDING)
+        self.size = StringVar(self.frame)
+        OptionMenu(self.frame, self.size, Field.SIZE_OPTIONS[0],
+                   *Field.SIZE_OPTIONS).grid(column=1, row=5, sticky='W')
 
     # Get the field input path (excel file) from the user and displays it in the relevant entry box.
     def select(self) -> None:
-        if dialog_path := tkinter.filedialog.askopenfilename(filetypes=(('Excel', '*.xlsx'), ('Excel', '*.xls'))):
+        if dialog_path := tkinter.filedialog.askopenfilename(filetypes=(('Excel', '*.xlsx'), ('Excel', '*.xls'), ('CSV', '*.csv'))):
             self.path.set(dialog_path)
 
     # Populate field's data variable by reading the file specified by path variable.
     def read(self) -> None:
         try:
-            column = int(self.column.get())
-            start_row = int(self.start_row.get())
-            end_row = int(self.end_row.get())
-            assert start_row > 0, 'Start row must be greater than 0.'
-            if end_row == 0:  # End row 0 = no limit.
-                end_row = None
-            else:
-                assert end_row >= start_row, 'End row must be greater than or equal to start row.'
-            self.data = xlrd.open_workbook(self.path.get()).sheet_by_index(
-                0).col_slice(column - 1, start_rowx=start_row - 1, end_rowx=end_row)
+            self.data = read_column(self.path.get(), int(self.column.get()), int(
+                self.start_row.get()), int(self.end_row.get()))
             # Show to the user how many values were read.
             self.values_amount.set(len(self.data))
         except Exception as e:
             print(e)
 
-    # Draw field's marks (QR, Text and Hole objects).
-    def draw(self, index: int, sheet: ezdxf.drawing.Drawing, layer: int, sign_origin_x: float, sign_origin_y: float, sign_width: float, sign_height: float) -> None:
-        if len(self.data) > index:
-            value = self.data[index].value
-            for mark_iid in self.marks:
-                self.marks[mark_iid].draw(
-                    value, sheet, layer, sign_origin_x, sign_origin_y, sign_width, sign_height)
+    # Freeze the read values and the settings of field's marks (QR, Text and Hole objects).
+    def spec(self) -> FieldSpec:
+        return FieldSpec(Column(self.data), tuple(mark.spec() for mark in self.marks.values()))
+
+
+# Canvas that previews the layout of a job. Drag to pan and use the mouse wheel to zoom. Only the layers and
+# signs inside the view are drawn, with less detail when they are small or there are many of them.
+class Preview:
+    ZOOM_STEP = 1.25
+    MARGIN = 10  # Pixels around the fitted layout.
+    LAYER_COLOR = '#888888'
+    SIGN_COLOR = '#4a7ab5'
+    MARK_COLORS = {'QR': '#333333', 'Text': '#c0504d', 'Hole': '#2e8b57'}
+
+    def __init__(self, master: Tk) -> None:
+        self.canvas = Canvas(master, background='white', highlightthickness=0)
+        self.scene = None
+        # Drawing units per pixel is 1 / scale, view_x and view_y are the drawing coordinates of the top left corner.
+        self.scale = 1.0
+        self.view_x = 0.0
+        self.view_y = 0.0
+        self.drag_start = (0, 0)
+        self.redraw_pending = False
+        self.canvas.bind('<ButtonPress-1>', self.drag_started)
+        self.canvas.bind('<B1-Motion>', self.dragged)
+        self.canvas.bind('<MouseWheel>', lambda event: self.zoom(event, event.delta > 0))
+        self.canvas.bind('<Button-4>', lambda event: self.zoom(event, True))
+        self.canvas.bind('<Button-5>', lambda event: self.zoom(event, False))
+        self.canvas.bind('<Configure>', lambda event: self.schedule_redraw())
+
+    # Show the layout of a job, zoomed to fit the view.
+    def show(self, job: Job) -> None:
+        self.scene = Scene(job)
+        left, bottom, right, top = self.scene.extent
+        width = max(self.canvas.winfo_width() - 2 * Preview.MARGIN, 1)
+        height = max(self.canvas.winfo_height() - 2 * Preview.MARGIN, 1)
+        self.scale = min(width / (right - left), height / (top - bottom))
+        self.view_x = left - Preview.MARGIN / self.scale
+        self.view_y = top + Preview.MARGIN / self.scale
+        self.schedule_redraw()
+
+    def drag_started(self, event: Event) -> None:
+        self.drag_start = (event.x, event.y)
+
+    def dragged(self, event: Event) -> None:
+        self.view_x -= (event.x - self.drag_start[0]) / self.scale
+        self.view_y += (event.y - self.drag_start[1]) / self.scale
+        self.drag_start = (event.x, event.y)
+        self.schedule_redraw()
+
+    # Zoom in or out keeping the point under the cursor in place.
+    def zoom(self, event: Event, zoom_in: bool) -> None:
+        factor = Preview.ZOOM_STEP if zoom_in else 1 / Preview.ZOOM_STEP
+        x = self.view_x + event.x / self.scale
+        y = self.view_y - event.y / self.scale
+        self.scale *= factor
+        self.view_x = x - event.x / self.scale
+        self.view_y = y + event.y / self.scale
+        self.schedule_redraw()
+
+    # Redraw once the pending events are handled, so a burst of drag or wheel events redraws only once.
+    def schedule_redraw(self) -> None:
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.canvas.after_idle(self.redraw)
+
+    # Canvas coordinates of a rectangle given in drawing coordinates.
+    def to_canvas(self, left: float, bottom: float, right: float, top: float) -> Tuple[float, float, float, float]:
+        return ((left - self.view_x) * self.scale, (self.view_y - top) * self.scale,
+                (right - self.view_x) * self.scale, (self.view_y - bottom) * self.scale)
+
+    def redraw(self) -> None:
+        self.redraw_pending = False
+        self.canvas.delete('all')
+        if self.scene is None:
+            return
+        left = self.view_x
+        top = self.view_y
+        right = left + self.canvas.winfo_width() / self.scale
+        bottom = top - self.canvas.winfo_height() / self.scale
+
+        for layer, *bounds in self.scene.visible_layers(left, bottom, right, top):
+            x0, y0, x1, y1 = self.to_canvas(*bounds)
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline=Preview.LAYER_COLOR)
+            self.canvas.create_text(x0, y0, text=str(layer), anchor='sw', fill=Preview.LAYER_COLOR)
+
+        visible = self.scene.visible_signs(left, bottom, right, top)
+        detail = self.scene.detail(self.scale, len(visible))
+        if detail == 'LAYERS':
+            return
+        for position in visible.tolist():
+            x0, y0, x1, y1 = self.to_canvas(*self.scene.bounds[position])
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline=Preview.SIGN_COLOR)
+            if detail == 'MARKS':
+                for shape in self.scene.sign_shapes(position):
+                    x0, y0, x1, y1 = self.to_canvas(shape.left, shape.bottom, shape.right, shape.top)
+                    color = Preview.MARK_COLORS[shape.kind]
+                    if shape.kind == 'QR':
+                        self.canvas.create_rectangle(x0, y0, x1, y1, outline=color, fill=color)
+                    elif shape.kind == 'Text':
+                        self.canvas.create_rectangle(x0, y0, x1, y1, outline=color)
+                    else:
+                        self.canvas.create_oval(x0, y0, x1, y1, outline=color)
 
 
 class App(Tk):
@@ -263,18 +362,28 @@ class App(Tk):
     DEFAULT_SHEET_WIDHT = 300.0
     DEFAULT_SHEET_HEIGHT = 300.0
     DEFAULT_SHEETS_PER_FILE = 0
+    DEFAULT_NESTING = False
+    DEFAULT_ROTATE = False
+    DEFAULT_STATS = False
+    DEFAULT_INCREMENTAL = False
+    DEFAULT_OPTIMIZE_CUTS = False
+    DEFAULT_BINARY = False
+    DEFAULT_ZIP = False
     MAX_SHEET_WIDTH = 470
     MAX_SHEET_HEIGHT = 310
     MAX_SHEETS_PER_FILE = 100
+    DEFAULT_WORKERS = 1  # 0 = One per CPU.
+    MAX_WORKERS = 64
+    PROGRESS_INTERVAL = 100  # Milliseconds between progress bar updates.
     SPINBOX_WIDTH = 8
     PADDING = 2
-    DXF_VERSIONS = ('R2000', 'R2004', 'R2007', 'R2010', 'R2013', 'R2018')
+    DXF_VERSIONS = DXF_VERSIONS
 
     # Initialize GUI layout.
     def __init__(self) -> None:
         super().__init__()
         self.title('KylttiMaker')
-        self.minsize(640, 480)
+        self.minsize(960, 480)
 
         # Tree widget that displays fields and their relative marks in a hierarchy.
         self.tree = Treeview(self, selectmode='browse')
@@ -286,7 +395,9 @@ class App(Tk):
         self.bind('<Delete>', self.remove)
         self.tree.pack(side=LEFT, fill=BOTH)
         self.properties = LabelFrame(self, text='Properties')
-        self.properties.pack(side=RIGHT, fill=BOTH, expand=1)
+        self.properties.pack(side=RIGHT, fill=Y)
+        self.preview = Preview(self)
+        self.preview.canvas.pack(side=LEFT, fill=BOTH, expand=1)
         self.fields = {}
         self.selected_iid = None
 
@@ -327,14 +438,71 @@ class App(Tk):
                 width=App.SPINBOX_WIDTH).grid(column=1, row=2, sticky='WE')
         Label(self.frame, text='(0 = No limit)').grid(
             column=2, row=2, columnspan=2, sticky='W')
-        Label(self.frame, text='DXF version').grid(column=0, row=4, sticky='E', pady=App.PADDING)
+        Label(self.frame, text='Blocks').grid(
+            column=0, row=3, sticky='E', pady=App.PADDING)
+        self.blocks = StringVar(self.frame)
+        OptionMenu(self.frame, self.blocks,
+                   Job.BLOCK_OPTIONS[0], *Job.BLOCK_OPTIONS).grid(column=1, row=3, sticky='W')
+        Label(self.frame, text='Workers').grid(
+            column=2, row=3, sticky='E', pady=App.PADDING)
+        self.workers_var = StringVar(self.frame)
+        self.workers_var.set(App.DEFAULT_WORKERS)
+        Spinbox(self.frame, to=App.MAX_WORKERS, textvariable=self.workers_var,
+                width=App.SPINBOX_WIDTH).grid(column=3, row=3, sticky='WE')
+        self.nesting = BooleanVar(self.frame)
+        self.nesting.set(App.DEFAULT_NESTING)
+        Checkbutton(self.frame, text='Nesting', variable=self.nesting).grid(
+            column=1, row=4, sticky='W', pady=App.PADDING)
+        self.rotate = BooleanVar(self.frame)
+        self.rotate.set(App.DEFAULT_ROTATE)
+        Checkbutton(self.frame, text='Rotation', variable=self.rotate).grid(
+            column=3, row=4, sticky='W')
+        Label(self.frame, text='DXF version').grid(column=0, row=5, sticky='E', pady=App.PADDING)
         self.dxf_version = StringVar(self.frame)
         OptionMenu(self.frame, self.dxf_version,
-                   App.DXF_VERSIONS[0], *App.DXF_VERSIONS).grid(column=1, row=4, sticky='W')
-        Button(self.frame, text='Create',
-               command=self.create).grid(column=2, row=4, columnspan=2)
+                   App.DXF_VERSIONS[0], *App.DXF_VERSIONS).grid(column=1, row=5, sticky='W')
+        Label(self.frame, text='Backend').grid(
+            column=2, row=5, sticky='E', pady=App.PADDING)
+        self.backend = StringVar(self.frame)
+        OptionMenu(self.frame, self.backend,
+                   Job.BACKEND_OPTIONS[0], *Job.BACKEND_OPTIONS).grid(column=3, row=5, sticky='W')
+        self.stats = BooleanVar(self.frame)
+        self.stats.set(App.DEFAULT_STATS)
+        Checkbutton(self.frame, text='Statistics', variable=self.stats).grid(
+            column=1, row=6, sticky='W', pady=App.PADDING)
+        self.incremental = BooleanVar(self.frame)
+        self.incremental.set(App.DEFAULT_INCREMENTAL)
+        Checkbutton(self.frame, text='Incremental', variable=self.incremental).grid(
+            column=3, row=6, sticky='W')
+        self.optimize_cuts = BooleanVar(self.frame)
+        self.optimize_cuts.set(App.DEFAULT_OPTIMIZE_CUTS)
+        Checkbutton(self.frame, text='Optimize cuts', variable=self.optimize_cuts).grid(
+            column=1, row=7, sticky='W', pady=App.PADDING)
+        self.binary = BooleanVar(self.frame)
+        self.binary.set(App.DEFAULT_BINARY)
+        Checkbutton(self.frame, text='Binary', variable=self.binary).grid(
+            column=3, row=7, sticky='W')
+        self.zip = BooleanVar(self.frame)
+        self.zip.set(App.DEFAULT_ZIP)
+        Checkbutton(self.frame, text='Zip archive', variable=self.zip).grid(
+            column=1, row=8, sticky='W', pady=App.PADDING)
+        self.create_button = Button(self.frame, text='Create', command=self.create)
+        Button(self.frame, text='Preview', command=self.show_preview).grid(
+            column=0, row=9, columnspan=2, pady=App.PADDING)
+        self.create_button.grid(column=2, row=9, columnspan=2)
+        self.progress_bar = Progressbar(self.frame)
+        self.cancel_button = Button(self.frame, text='Cancel', command=self.cancel)
         self.frame.pack()
 
+        # State of the generation running in the background.
+        self.worker = None
+        self.cancel_event = threading.Event()
+        self.signs_done = 0
+        self.total_signs = 0
+        self.error = None
+        self.metrics = DISABLED
+        self.optimized_cuts = False
+
     # Display a popup menu with relevant options when right clicking on the tree widget item.
     def tree_right_click(self, event: Event) -> None:
         menu = Menu(self, tearoff=0)
@@ -437,136 +605,135 @@ class App(Tk):
         for item in self.tree.selection():
             self.tree.selection_remove(item)
 
+    # Freeze the entered settings into a job for the engine.
+    def job(self) -> Job:
+        layout = Layout(
+            sheet_width=float(self.sheet_width_var.get()),
+            sheet_height=float(self.sheet_height_var.get()),
+            sign_width=float(self.sign_width_var.get()),
+            sign_height=float(self.sign_height_var.get()),
+            layers_per_sheet=int(self.layers_per_sheet_var.get())
+        )
+        nesting = None
+        if self.nesting.get():
+            # Sign sizes are taken from the fields marked as widths and heights, the sign size above is the default.
+            widths = next((field.data for field in self.fields.values() if field.size.get() == 'WIDTH'), [])
+            heights = next((field.data for field in self.fields.values() if field.size.get() == 'HEIGHT'), [])
+            nesting = Nesting(sign_sizes(widths, heights, layout.sign_width, layout.sign_height), self.rotate.get())
+        return Job(layout, tuple(field.spec() for field in self.fields.values()), self.dxf_version.get(), self.blocks.get(), nesting, self.backend.get(), self.optimize_cuts.get(), self.binary.get())
+
+    # Preview the layout of the entered settings without creating any sheets.
+    def show_preview(self) -> None:
+        try:
+            job = self.job()
+            job.plan  # Nesting happens here.
+        except ValueError:
+            print('Invalid dimensions.')
+            return
+        except AssertionError as e:
+            print(e)
+            return
+        self.preview.show(job)
+
     # Create sheets according to entered settings.
     def create(self) -> None:
         if not self.fields:
             print('No fields.')
             return
-
-        # Calculate the length of the longest field (some fields can have less values than others).
-        total_signs = 0
-        for field_iid in self.fields:
-            total_signs = max(total_signs, len(self.fields[field_iid].data))
-        if total_signs == 0:
-            print('No fields with data.')
-            return
         try:
-            sheet_width = float(self.sheet_width_var.get())
-            sheet_height = float(self.sheet_height_var.get())
-            sign_width = float(self.sign_width_var.get())
-            sign_height = float(self.sign_height_var.get())
-            layers_per_sheet = int(self.layers_per_sheet_var.get())
-            assert sign_width > 0, 'Sign width must be greater than 0.'
-            assert sign_height > 0, 'Sign height must be greater than 0.'
-            assert sheet_width >= sign_width, 'Sheet width must be greater than sign width.'
-            assert sheet_height >= sign_height, 'Sheet height must be greater than sign height.'
+            job = self.job()
+            total_sheets = job.total_sheets  # Nesting happens here.
         except ValueError:
             print('Invalid dimensions.')
             return
         except AssertionError as e:
             print(e)
             return
+        total_signs = job.total_signs
+        if total_signs == 0:
+            print('No fields with data.')
+            return
+        problems = validate(job)
+        if problems:
+            for problem in problems:
+                print(problem)
+            return
 
-        # Show progress bar.
-        progress_bar = Progressbar(self.frame)
-        progress_bar.grid(column=0, row=5, columnspan=4, sticky='WE')
-
-        # Calculate the needed values to define sheet layout.
-        signs_per_row = int(sheet_width // sign_width)
-        signs_per_column = int(sheet_height // sign_height)
-        signs_per_layer = signs_per_row * signs_per_column
-        # Ceiling division.
-        total_layers = -int(-total_signs // signs_per_layer)
-        if layers_per_sheet > 0:
-            total_sheets = -int(-total_layers // layers_per_sheet)
-        else:
-            total_sheets = 1
-
-        print(f'Marking total of {total_signs} signs ({sign_width} x {sign_height}).')
-        print(f'Sheet size of {sheet_width} x {sheet_height} fits {signs_per_row} x {signs_per_column} signs,')
-        print(f'so the effective sheet size is {signs_per_row * sign_width} x {signs_per_column * sign_height}.')
-        print(f'Total of {total_layers} layer(s) are needed.')
-        if layers_per_sheet == 0:
-            print('There is no limit on the maximum amount of layers per sheet,')
+        try:
+            workers = int(self.workers_var.get())
+        except ValueError:
+            print('Invalid number of workers.')
+            return
+
+        # Get a output directory if there are multiple sheets to be saved, otherwise get path for the single output (.dxf) file.
+        # All sheets can also be packed into one zip archive.
+        incremental = self.incremental.get()
+        if self.zip.get():
+            if incremental:
+                print('Zip archives can not be regenerated incrementally.')
+                return
+            output = tkinter.filedialog.asksaveasfilename(
+                defaultextension='.zip', filetypes=(('Zip', '*.zip'), ('All files', '*.*')))
+        elif total_sheets > 1:
+            output = tkinter.filedialog.askdirectory()
         else:
-            print(f'There are maximum of {layers_per_sheet} layer(s) per sheet,')
-        print(f'so total of {total_sheets} sheet(s) are needed.')
-
-        # Create needed sheet objects.
-        print('Creating sheets.')
-        sheets = []
-        for _ in range(total_sheets):
-            sheets.append(ezdxf.new(self.dxf_version.get()))
-
-        # Iterate over all layers and draw their outline based on how many signs that layer will have.
-        print('Drawing layer outlines.')
-        for layer in range(total_layers):
-            max_x = sign_width * signs_per_row
-            max_y = -sign_height * signs_per_column
-            if layer == total_layers - 1:  # If last layer.
-                signs_in_last_sheet = total_signs - layer * signs_per_layer
-                if signs_in_last_sheet < signs_per_row:
-                    max_x = sign_width * signs_in_last_sheet
-                max_y = sign_height * (-signs_in_last_sheet // signs_per_row)
-            if layers_per_sheet > 0:
-                sheet_index = layer // layers_per_sheet
-            else:
-                sheet_index = 0
-            # Draw layer outline (left and top side bounds).
-            sheets[sheet_index].modelspace().add_lwpolyline(
-                [(0, max_y), (0, 0), (max_x, 0)], dxfattribs={'layer': str(layer)})
+            output = tkinter.filedialog.asksaveasfilename(
+                defaultextension='.dxf', filetypes=(('DXF', '*.dxf'), ('All files', '*.*')))
+        if not output:
+            return
 
-        # Iterate over each sign.
+        job.describe()
         print('Drawing marks.')
-        for sign_index in range(total_signs):
-            # Update progress bar value.
-            progress_bar['value'] = (sign_index + 1) / total_signs * 100
-            progress_bar.update()
-
-            # Calculate in which position, in which layer of which sheet the current sign should be drawn.
-            layer = sign_index // signs_per_layer
-            layer_position = sign_index % signs_per_layer
-            sign_origin_x = (layer_position % signs_per_row) * sign_width
-            sign_origin_y = -(layer_position // signs_per_row) * sign_height
-            if layers_per_sheet > 0:
-                sheet_index = layer // layers_per_sheet
-            else:
-                sheet_index = 0
-            sheet = sheets[sheet_index]
-
-            # Draw marks (QR, Text and Hole objects).
-            for field_iid in self.fields:
-                try:
-                    self.fields[field_iid].draw(
-                        sign_index, sheet, layer, sign_origin_x, sign_origin_y, sign_width, sign_height)
-                except Exception as e:
-                    print(e)
-                    progress_bar.grid_forget()
-                    return
-
-            # Draw sign outline (right and bottom side bounds).
-            sign_outline = [
-                (sign_origin_x, sign_origin_y - sign_height),
-                (sign_origin_x + sign_width, sign_origin_y - sign_height),
-                (sign_origin_x + sign_width, sign_origin_y)
-            ]
-            sheet.modelspace().add_lwpolyline(
-                sign_outline, dxfattribs={'layer': str(layer)})
-
-        # Save sheets.
-        # Get a output directory if there are multiple sheets to be saved, otherwise get path for the single output (.dxf) file.
-        print('Saving.')
-        if total_sheets > 1:
-            if directory := tkinter.filedialog.askdirectory():
-                for index, sheet in enumerate(sheets):
-                    # Indicate save progress.
-                    progress_bar['value'] = (index + 1) / len(sheets) * 100
-                    progress_bar.update()
-                    sheet.saveas(Path(directory) / f'sheet{index}.dxf')
-        elif path := tkinter.filedialog.asksaveasfilename(defaultextension='.dxf', filetypes=(('DXF', '*.dxf'), ('All files', '*.*'))):
-            sheets[0].saveas(path)
-        progress_bar.grid_forget()
-        print('Success.')
+        self.signs_done = 0
+        self.total_signs = total_signs
+        self.error = None
+        # The cut and travel lengths are counted in the metrics.
+        self.metrics = Metrics() if self.stats.get() or job.optimize_cuts else DISABLED
+        self.optimized_cuts = job.optimize_cuts
+        self.cancel_event.clear()
+        self.worker = threading.Thread(target=self.run_generation, args=(
+            job, output, workers, incremental), daemon=True)
+        self.worker.start()
+
+        # Show progress bar and cancel button.
+        self.create_button.state(['disabled'])
+        self.progress_bar['value'] = 0
+        self.progress_bar.grid(column=0, row=10, columnspan=3, sticky='WE')
+        self.cancel_button.grid(column=3, row=10)
+        self.after(App.PROGRESS_INTERVAL, self.poll)
+
+    # Run the engine. Called in the background thread, so it must not touch the GUI.
+    def run_generation(self, job: Job, output: str, workers: int, incremental: bool) -> None:
+        def progress(signs_done: int) -> None:
+            self.signs_done = signs_done
+        self.metrics.start()
+        try:
+            generate(job, output, workers, progress, self.cancel_event, self.metrics, incremental)
+        except Exception as e:
+            self.error = e
+        self.metrics.stop()
+
+    # Update progress bar at a fixed rate until the background generation is finished.
+    def poll(self) -> None:
+        self.progress_bar['value'] = self.signs_done / self.total_signs * 100
+        if self.worker.is_alive():
+            self.after(App.PROGRESS_INTERVAL, self.poll)
+            return
+        self.progress_bar.grid_forget()
+        self.cancel_button.grid_forget()
+        self.create_button.state(['!disabled'])
+        if self.error:
+            print(self.error)
+        else:
+            print('Success.')
+            if self.optimized_cuts:
+                print(cut_summary(self.metrics))
+            if self.stats.get():
+                print(self.metrics.summary())
+
+    # Ask the background generation to stop.
+    def cancel(self) -> None:
+        self.cancel_event.set()
 
 
 if __name__ == '__main__':
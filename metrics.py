@@ -0,0 +1,194 @@
+'''
+KylttiMaker metrics
+
+Timers and counters for the stages of a run: reading the input, layout,
+validation, layer and sign outlines, drawing each mark type, ordering cuts and
+saving. Entities and hatch paths are counted by wrapping the layouts they are
+drawn on. A run can optionally be profiled with cProfile. Disabled metrics only
+cost a method call per stage.
+'''
+
+import cProfile
+import json
+import pstats
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, ContextManager, Dict, Iterable, Optional, Union
+
+# Stages in the order they are reported.
+STAGES = ('read', 'layout', 'validate', 'outlines', 'QR', 'Text', 'Hole', 'cuts', 'save')
+# Number of functions listed from the profile.
+PROFILE_FUNCTIONS = 20
+
+DISABLED_STAGE = nullcontext()
+
+
+# Adds the time spent inside a with block to a stage.
+class Stage:
+    def __init__(self, metrics: 'Metrics', name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        seconds = time.perf_counter() - self.start
+        with self.metrics.lock:
+            total, calls = self.metrics.stages.get(self.name, (0.0, 0))
+            self.metrics.stages[self.name] = (total + seconds, calls + 1)
+
+
+# Hatch boundary paths that count the paths added to them.
+class CountingPaths:
+    def __init__(self, paths: Any, metrics: 'Metrics') -> None:
+        self.paths = paths
+        self.metrics = metrics
+
+    def add_polyline_path(self, path_vertices: Any, *args: Any, **kwargs: Any) -> Any:
+        self.metrics.count('hatch paths')
+        self.metrics.count('hatch vertices', len(path_vertices))
+        return self.paths.add_polyline_path(path_vertices, *args, **kwargs)
+
+
+# Hatch whose boundary paths are counted.
+class CountingHatch:
+    def __init__(self, hatch: Any, metrics: 'Metrics') -> None:
+        self.hatch = hatch
+        self.paths = CountingPaths(hatch.paths, metrics)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.hatch, name)
+
+
+# Layout (modelspace or block) that counts the entities added to it.
+class CountingLayout:
+    def __init__(self, layout: Any, metrics: 'Metrics') -> None:
+        self.layout = layout
+        self.metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.layout, name)
+
+    def add_lwpolyline(self, *args: Any, **kwargs: Any) -> Any:
+        self.metrics.count('LWPOLYLINE')
+        return self.layout.add_lwpolyline(*args, **kwargs)
+
+    def add_circle(self, *args: Any, **kwargs: Any) -> Any:
+        self.metrics.count('CIRCLE')
+        return self.layout.add_circle(*args, **kwargs)
+
+    def add_text(self, *args: Any, **kwargs: Any) -> Any:
+        self.metrics.count('TEXT')
+        return self.layout.add_text(*args, **kwargs)
+
+    def add_blockref(self, *args: Any, **kwargs: Any) -> Any:
+        self.metrics.count('INSERT')
+        return self.layout.add_blockref(*args, **kwargs)
+
+    def add_hatch(self, *args: Any, **kwargs: Any) -> CountingHatch:
+        self.metrics.count('HATCH')
+        return CountingHatch(self.layout.add_hatch(*args, **kwargs), self.metrics)
+
+
+# Stage timers, counters and an optional profile of a run. Stages and counts can be recorded from several
+# threads (e.g. sheets being saved in the background).
+class Metrics:
+    def __init__(self, enabled: bool = True, profile: bool = False) -> None:
+        self.enabled = enabled
+        self.stages: Dict[str, tuple] = {}
+        self.counts: Dict[str, int] = {}
+        self.profiler = cProfile.Profile() if enabled and profile else None
+        self.started: Optional[float] = None
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    # Context manager timing a stage.
+    def stage(self, name: str) -> ContextManager:
+        if not self.enabled:
+            return DISABLED_STAGE
+        return Stage(self, name)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        if self.enabled:
+            with self.lock:
+                self.counts[name] = self.counts.get(name, 0) + amount
+
+    # Layout that counts the entities drawn on it if metrics are enabled.
+    def wrap(self, layout: Any) -> Any:
+        if not self.enabled:
+            return layout
+        return CountingLayout(layout, self)
+
+    # Start the wall clock (and the profiler) of the run.
+    def start(self) -> None:
+        if self.enabled:
+            self.started = time.perf_counter()
+            if self.profiler:
+                self.profiler.enable()
+
+    def stop(self) -> None:
+        if self.enabled and self.started is not None:
+            if self.profiler:
+                self.profiler.disable()
+            self.seconds += time.perf_counter() - self.started
+            self.started = None
+
+    # Add the stages and counts of a report made elsewhere (e.g. in a worker process).
+    def merge(self, report: Dict[str, Any]) -> None:
+        for name, stage in report['stages'].items():
+            with self.lock:
+                seconds, calls = self.stages.get(name, (0.0, 0))
+                self.stages[name] = (seconds + stage['seconds'], calls + stage['calls'])
+        for name, amount in report['counts'].items():
+            self.count(name, amount)
+
+    # Functions that took the most time in the profile.
+    def profile_functions(self, limit: int = PROFILE_FUNCTIONS) -> Iterable[Dict[str, Any]]:
+        if self.profiler is None:
+            return []
+        stats = pstats.Stats(self.profiler)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        return [{'function': f'{file}:{line}({name})', 'calls': calls, 'own_seconds': own, 'total_seconds': total}
+                for (file, line, name), (_, calls, own, total, _) in functions]
+
+    def report(self) -> Dict[str, Any]:
+        stages = sorted(self.stages.items(), key=lambda item: (
+            STAGES.index(item[0]) if item[0] in STAGES else len(STAGES), item[0]))
+        return {
+            'seconds': self.seconds,
+            'stages': {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in stages},
+            'counts': dict(sorted(self.counts.items())),
+            'profile': list(self.profile_functions())
+        }
+
+    # Human readable summary of the report.
+    def summary(self) -> str:
+        report = self.report()
+        lines = [f'Total {report["seconds"]:.2f} s']
+        for name, stage in report['stages'].items():
+            share = f' ({stage["seconds"] / report["seconds"]:.0%})' if report['seconds'] else ''
+            lines.append(f'  {name:<10} {stage["seconds"]:8.2f} s{share:>7}  {stage["calls"]} call(s)')
+        for name, amount in report['counts'].items():
+            lines.append(f'  {name:<15} {amount}')
+        if report['profile']:
+            lines.append('Profile (cumulative):')
+            for function in report['profile']:
+                lines.append(f'  {function["total_seconds"]:8.2f} s {function["calls"]:>9}  {function["function"]}')
+        return '\n'.join(lines)
+
+    def save(self, path: Union[str, Path]) -> None:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=4)
+
+    # Write the raw profile for tools like snakeviz or pstats.
+    def save_profile(self, path: Union[str, Path]) -> None:
+        if self.profiler is not None:
+            self.profiler.dump_stats(str(path))
+
+
+# Metrics that record nothing, used when no metrics are given.
+DISABLED = Metrics(enabled=False)
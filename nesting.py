@@ -0,0 +1,160 @@
+'''
+KylttiMaker nesting
+
+Packs signs of different sizes onto sheet layers with a skyline bottom-left
+heuristic, optionally rotating signs by 90 degrees. Coordinates are relative
+to the top left corner of a layer with y growing downwards.
+'''
+
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+# Tolerance used when comparing coordinates.
+EPSILON = 1e-9
+
+
+# Position of a single sign on a layer. Width and height are the dimensions as placed (swapped if rotated).
+@dataclass(frozen=True)
+class Placement:
+    sign_index: int
+    x: float
+    y: float
+    width: float
+    height: float
+    rotated: bool = False
+
+
+# Result of nesting: the placements of every layer.
+@dataclass(frozen=True)
+class NestingPlan:
+    layers: Tuple[Tuple[Placement, ...], ...]
+    sheet_width: float
+    sheet_height: float
+
+    # Share of the used layers' area covered by signs.
+    @property
+    def utilization(self) -> float:
+        if not self.layers:
+            return 0.0
+        used = sum(placement.width * placement.height for layer in self.layers for placement in layer)
+        return used / (len(self.layers) * self.sheet_width * self.sheet_height)
+
+
+# Skyline of a single layer: segments [x, depth, width] covering the layer from left to right.
+class Skyline:
+    def __init__(self, width: float, height: float) -> None:
+        self.width = width
+        self.height = height
+        self.segments = [[0.0, 0.0, width]]
+
+    # Lowest (then leftmost) position where a rectangle fits as (bottom, x, y, segment index), or None.
+    def find(self, width: float, height: float) -> Tuple[float, float, float, int]:
+        best = None
+        segments = self.segments
+        for index, (x, _, _) in enumerate(segments):
+            if x + width > self.width + EPSILON:
+                break
+            y = 0.0
+            remaining = width
+            covered = index
+            while remaining > EPSILON:
+                y = max(y, segments[covered][1])
+                remaining -= segments[covered][2]
+                covered += 1
+            if y + height <= self.height + EPSILON and (best is None or (y + height, x) < best[:2]):
+                best = (y + height, x, y, index)
+        return best
+
+    # Raise the skyline under a placed rectangle.
+    def place(self, index: int, x: float, bottom: float, width: float) -> None:
+        segments = self.segments
+        segments.insert(index, [x, bottom, width])
+        # Shrink or remove the segments now covered by the new one.
+        right = x + width
+        following = index + 1
+        while following < len(segments):
+            segment = segments[following]
+            if segment[0] >= right - EPSILON:
+                break
+            overlap = right - segment[0]
+            if segment[2] <= overlap + EPSILON:
+                del segments[following]
+            else:
+                segment[0] = right
+                segment[2] -= overlap
+                break
+        # Merge neighbours of equal depth.
+        merged = [segments[0]]
+        for segment in segments[1:]:
+            if abs(segment[1] - merged[-1][1]) <= EPSILON:
+                merged[-1][2] += segment[2]
+            else:
+                merged.append(segment)
+        self.segments = merged
+
+
+# Pack signs of the given sizes (width, height) onto layers of the given size. Larger signs are placed
+# first; a new layer is started when the next sign does not fit on the current one.
+def nest(sizes: Sequence[Tuple[float, float]], sheet_width: float, sheet_height: float, rotate: bool = False) -> NestingPlan:
+    order = sorted(range(len(sizes)), key=lambda index: (
+        -max(sizes[index]), -min(sizes[index])))
+    layers = []
+    placements = []
+    skyline = Skyline(sheet_width, sheet_height)
+    for sign_index in order:
+        width, height = sizes[sign_index]
+        fits = width <= sheet_width + EPSILON and height <= sheet_height + EPSILON
+        fits_rotated = rotate and height <= sheet_width + EPSILON and width <= sheet_height + EPSILON
+        assert fits or fits_rotated, f'Sign {sign_index + 1} ({width} x {height}) does not fit on the sheet.'
+        for attempt in range(2):
+            options = []
+            if fits:
+                options.append((skyline.find(width, height), False))
+            if fits_rotated and abs(width - height) > EPSILON:
+                options.append((skyline.find(height, width), True))
+            options = [(position, rotated) for position, rotated in options if position]
+            if options:
+                break
+            # Start a new layer.
+            layers.append(tuple(placements))
+            placements = []
+            skyline = Skyline(sheet_width, sheet_height)
+        (bottom, x, y, index), rotated = min(
+            options, key=lambda option: option[0][:2])
+        placed_width, placed_height = (height, width) if rotated else (width, height)
+        skyline.place(index, x, bottom, placed_width)
+        placements.append(Placement(sign_index, x, y, placed_width, placed_height, rotated))
+    if placements:
+        layers.append(tuple(placements))
+    return NestingPlan(tuple(layers), sheet_width, sheet_height)
+
+
+# Merge overlapping and touching collinear intervals.
+def merge_intervals(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + EPSILON:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# Outlines of the given placements as line segments ((x0, y0), (x1, y1)) where shared edges of
+# neighbouring signs are drawn only once and collinear edges are joined into continuous lines.
+def cut_lines(placements: Sequence[Placement]) -> List[Tuple[Tuple[float, float], Tuple[float, float]]]:
+    horizontal: Dict[float, List[Tuple[float, float]]] = {}
+    vertical: Dict[float, List[Tuple[float, float]]] = {}
+    for placement in placements:
+        left, top = placement.x, placement.y
+        right, bottom = left + placement.width, top + placement.height
+        for y in (top, bottom):
+            horizontal.setdefault(round(y, 9), []).append((left, right))
+        for x in (left, right):
+            vertical.setdefault(round(x, 9), []).append((top, bottom))
+    lines = []
+    for y in sorted(horizontal):
+        lines.extend(((start, y), (end, y)) for start, end in merge_intervals(horizontal[y]))
+    for x in sorted(vertical):
+        lines.extend(((x, start), (x, end)) for start, end in merge_intervals(vertical[x]))
+    return lines
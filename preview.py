@@ -0,0 +1,141 @@
+'''
+KylttiMaker preview
+
+Geometry of a layout preview without drawing any sheets: the layers of the
+sheets side by side, the sign outlines and simplified marks (QR codes as
+squares, text as boxes and holes as circles). Signs are placed with the same
+placements the sheets are drawn with, so the preview matches the output.
+Sign bounds are kept in arrays so the signs inside a viewport are found with
+one vectorized test, and the amount of detail drawn depends on how large the
+signs are on the screen and how many of them are visible.
+'''
+
+import math
+from dataclasses import dataclass
+from typing import Any, List, Tuple
+import numpy as np
+from engine import HoleSpec, Job, QRSpec
+from glyphs import align_offset, text_box
+
+# Space between layers in the preview (drawing units).
+LAYER_GAP = 20.0
+# Width of a character relative to the text height for text drawn as TEXT entities (no font file).
+TEXT_WIDTH = 0.6
+# Smallest on-screen size (pixels) of a sign whose outline or whose marks are drawn.
+OUTLINE_DETAIL = 3.0
+MARK_DETAIL = 40.0
+# Most signs drawn at once with outlines or with marks. More visible signs lower the detail.
+MAX_OUTLINED_SIGNS = 5000
+MAX_MARKED_SIGNS = 500
+
+
+# Simplified mark in drawing coordinates (y up): a QR square, a text box or a hole circle given by its bounds.
+@dataclass(frozen=True)
+class Shape:
+    kind: str
+    left: float
+    bottom: float
+    right: float
+    top: float
+
+
+# Rectangle (left, top, right, bottom) a mark covers on a sign, relative to the sign's top left corner
+# with y pointing down, and the kind of shape drawn for it.
+def mark_bounds(mark: Any, value: str) -> Tuple[str, Tuple[float, float, float, float]]:
+    if isinstance(mark, QRSpec):
+        return 'QR', (mark.position_x, mark.position_y, mark.position_x + mark.size, mark.position_y + mark.size)
+    if isinstance(mark, HoleSpec):
+        radius = mark.diameter / 2
+        return 'Hole', (mark.position_x - radius, mark.position_y - radius, mark.position_x + radius, mark.position_y + radius)
+    if mark.font:
+        left, bottom, right, top = text_box(mark.font, mark.size, value, mark.align)
+    else:
+        width = TEXT_WIDTH * mark.size * len(value)
+        left, bottom = align_offset(mark.align, width, mark.size, 0.0)
+        right, top = left + width, bottom + mark.size
+    return 'Text', (mark.position_x + left, mark.position_y - top, mark.position_x + right, mark.position_y - bottom)
+
+
+# All layers and signs of a job laid out for previewing. Each row holds the layers of one sheet, or if
+# there is no limit of layers per sheet, the layers are wrapped into a square.
+class Scene:
+    def __init__(self, job: Job) -> None:
+        self.job = job
+        layout = job.layout
+        total_layers = job.total_layers
+        self.columns = layout.layers_per_sheet or max(1, math.ceil(math.sqrt(total_layers)))
+        self.layer_width = layout.sheet_width + LAYER_GAP
+        self.layer_height = layout.sheet_height + LAYER_GAP
+
+        sign_indices, bounds, rotated = [], [], []
+        for layer in range(total_layers):
+            origin_x, origin_y = self.layer_origin(layer)
+            for placement in job.layer_placements(layer):
+                sign_indices.append(placement.sign_index)
+                bounds.append((origin_x + placement.x, origin_y - placement.y - placement.height,
+                               origin_x + placement.x + placement.width, origin_y - placement.y))
+                rotated.append(placement.rotated)
+        self.sign_indices = np.array(sign_indices, dtype=int)
+        self.bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+        self.rotated = np.array(rotated, dtype=bool)
+        self.total_layers = total_layers
+
+    # Top left corner of a layer in the preview.
+    def layer_origin(self, layer: int) -> Tuple[float, float]:
+        return (layer % self.columns) * self.layer_width, -(layer // self.columns) * self.layer_height
+
+    # Bounds (left, bottom, right, top) of the whole preview.
+    @property
+    def extent(self) -> Tuple[float, float, float, float]:
+        rows = max(1, -(-self.total_layers // self.columns))
+        columns = min(self.columns, max(1, self.total_layers))
+        return 0.0, -rows * self.layer_height + LAYER_GAP, columns * self.layer_width - LAYER_GAP, 0.0
+
+    # Layers (index, left, bottom, right, top) that overlap the given view.
+    def visible_layers(self, left: float, bottom: float, right: float, top: float) -> List[Tuple[int, float, float, float, float]]:
+        layout = self.job.layout
+        first_column = max(0, int(left // self.layer_width))
+        last_column = min(self.columns - 1, int(right // self.layer_width))
+        first_row = max(0, int(-top // self.layer_height))
+        last_row = int(-bottom // self.layer_height)
+        layers = []
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                layer = row * self.columns + column
+                if layer < self.total_layers:
+                    x, y = self.layer_origin(layer)
+                    layers.append((layer, x, y - layout.sheet_height, x + layout.sheet_width, y))
+        return layers
+
+    # Positions (into the sign arrays) of the signs that overlap the given view.
+    def visible_signs(self, left: float, bottom: float, right: float, top: float) -> np.ndarray:
+        bounds = self.bounds
+        return np.flatnonzero((bounds[:, 0] <= right) & (bounds[:, 2] >= left) &
+                              (bounds[:, 1] <= top) & (bounds[:, 3] >= bottom))
+
+    # Level of detail ('LAYERS', 'OUTLINES' or 'MARKS') for a number of visible signs when one drawing unit is scale pixels.
+    def detail(self, scale: float, visible: int) -> str:
+        layout = self.job.layout
+        sign_size = min(layout.sign_width, layout.sign_height) * scale
+        if sign_size >= MARK_DETAIL and visible <= MAX_MARKED_SIGNS:
+            return 'MARKS'
+        if sign_size >= OUTLINE_DETAIL and visible <= MAX_OUTLINED_SIGNS:
+            return 'OUTLINES'
+        return 'LAYERS'
+
+    # Simplified marks of the sign at the given position of the sign arrays.
+    def sign_shapes(self, position: int) -> List[Shape]:
+        sign_index = int(self.sign_indices[position])
+        left, bottom, right, top = self.bounds[position]
+        shapes = []
+        for field_spec, value in zip(self.job.fields, self.job.sign_values(sign_index)):
+            if value is None:
+                continue
+            for mark in field_spec.marks:
+                kind, (x0, y0, x1, y1) = mark_bounds(mark, value)
+                if self.rotated[position]:
+                    # Turned counterclockwise: the sign's top edge is on the left side of the placement.
+                    shapes.append(Shape(kind, left + y0, bottom + x0, left + y1, bottom + x1))
+                else:
+                    shapes.append(Shape(kind, left + x0, top - y1, left + x1, top - y0))
+        return shapes
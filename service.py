@@ -0,0 +1,196 @@
+'''
+KylttiMaker service
+
+Watches an input directory for job descriptions (.json) and generates their
+sheets into an output directory without starting the GUI. A job is picked up
+once its file and the spreadsheets and fonts it refers to exist and have
+stopped changing, so files still being copied are left alone. Jobs run in a
+pool of long-lived worker processes: modules, ezdxf resources and the QR and
+glyph caches are loaded once per worker and stay warm between jobs, so the
+time per job is just the generation itself.
+
+Each job is written to its own directory named after the job file, and
+regenerated incrementally if the same job arrives again. Finished job files
+are moved into done/ and failed ones into failed/ next to a .txt file with the
+error.
+
+Usage: python service.py input_directory output_directory -j 2
+'''
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import ezdxf
+from engine import DXF_VERSIONS, generate, load_job, validate
+
+# Seconds between looks into the input directory.
+POLL_INTERVAL = 1.0
+# Subdirectories of the input directory finished job files are moved to.
+DONE_DIRECTORY = 'done'
+FAILED_DIRECTORY = 'failed'
+
+
+# Run once in every worker process as it starts. The first new drawing of each DXF version loads ezdxf's
+# resources, which is then already done when the first job arrives. Interrupts are left to the service,
+# which lets running jobs finish.
+def warm_up() -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for dxf_version in DXF_VERSIONS:
+        ezdxf.new(dxf_version)
+
+
+# Generate the sheets of a job file into the output directory in a worker process. Returns the number of
+# sheets and the seconds it took.
+def run_job(job_path: Path, output: Path) -> Tuple[int, float]:
+    start = time.perf_counter()
+    job = load_job(job_path)
+    assert job.total_signs > 0, 'No fields with data.'
+    problems = validate(job)
+    assert not problems, '\n'.join(map(str, problems))
+    output.mkdir(parents=True, exist_ok=True)
+    paths = generate(job, output, incremental=True)
+    return len(paths), time.perf_counter() - start
+
+
+# Spreadsheets and fonts a job description refers to, relative to the job file.
+def job_inputs(job_path: Path) -> List[Path]:
+    try:
+        with open(job_path, encoding='utf-8') as file:
+            description = json.load(file)
+    except (OSError, ValueError):
+        return []
+    paths = []
+
+    def collect(item: Any) -> None:
+        if isinstance(item, dict):
+            for key, value in item.items():
+                if key in ('path', 'font') and isinstance(value, str) and value:
+                    paths.append(job_path.parent / value)
+                else:
+                    collect(value)
+        elif isinstance(item, list):
+            for value in item:
+                collect(value)
+    collect(description)
+    return paths
+
+
+# Size and modification time of a job file and its inputs, None if an input is still missing.
+def job_state(job_path: Path) -> Optional[Tuple[Tuple[int, int], ...]]:
+    try:
+        return tuple((stat.st_size, stat.st_mtime_ns) for stat in map(os.stat, [job_path] + job_inputs(job_path)))
+    except OSError:
+        return None
+
+
+# Watches the input directory and runs the jobs that are ready, up to the given amount at once.
+class Service:
+    def __init__(self, input_directory: Path, output_directory: Path, jobs: int = 1) -> None:
+        self.input_directory = input_directory
+        self.output_directory = output_directory
+        self.jobs = jobs
+        # State of each waiting job file at the last look.
+        self.states: Dict[Path, Tuple[Tuple[int, int], ...]] = {}
+        self.running: Dict[Future, Path] = {}
+
+    # Job files whose state has not changed since the last look, oldest first.
+    def ready_jobs(self) -> List[Path]:
+        states = {}
+        ready = []
+        for job_path in self.input_directory.glob('*.json'):
+            if job_path in self.running.values():
+                continue
+            state = job_state(job_path)
+            if state is None:
+                continue
+            if self.states.get(job_path) == state:
+                ready.append(job_path)
+            states[job_path] = state
+        self.states = states
+        return sorted(ready, key=lambda job_path: states[job_path][0][1])
+
+    # Move a finished job file into the done or failed directory, with the error next to a failed one.
+    def finish(self, job_path: Path, error: Optional[BaseException] = None) -> None:
+        directory = self.input_directory / (FAILED_DIRECTORY if error else DONE_DIRECTORY)
+        directory.mkdir(exist_ok=True)
+        if error:
+            with open(directory / (job_path.stem + '.txt'), 'w', encoding='utf-8') as file:
+                file.write(f'{error}\n')
+        job_path.replace(directory / job_path.name)
+
+    # Report finished jobs and move their files.
+    def collect(self) -> None:
+        for future in [future for future in self.running if future.done()]:
+            job_path = self.running.pop(future)
+            try:
+                sheets, seconds = future.result()
+            except Exception as e:
+                print(f'{job_path.name} failed: {e}')
+                self.finish(job_path, e)
+            else:
+                print(f'{job_path.name}: {sheets} sheet(s) in {seconds:.2f} s.')
+                self.finish(job_path)
+
+    # Collect finished jobs and start the ready ones. Returns True if any job is waiting or running.
+    def poll(self, executor: ProcessPoolExecutor) -> bool:
+        self.collect()
+        for job_path in self.ready_jobs():
+            if len(self.running) >= self.jobs:
+                break
+            print(f'{job_path.name} started.')
+            self.running[executor.submit(run_job, job_path, self.output_directory / job_path.stem)] = job_path
+        return bool(self.running or self.states)
+
+    # Serve until interrupted, or with once set, until the jobs present at the start are finished. When
+    # interrupted no more jobs are started and the running ones are finished first.
+    def serve(self, once: bool = False, interval: float = POLL_INTERVAL) -> None:
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+        with ProcessPoolExecutor(self.jobs, initializer=warm_up) as executor:
+            try:
+                while self.poll(executor) or not once:
+                    if self.running:
+                        wait(self.running, interval, FIRST_COMPLETED)
+                    else:
+                        time.sleep(interval)
+            except KeyboardInterrupt:
+                if self.running:
+                    print(f'Stopping after {len(self.running)} running job(s).')
+                    wait(self.running)
+                    self.collect()
+                raise
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Watch a directory for job descriptions and create their sheets into another directory.')
+    parser.add_argument('input', help='directory watched for job description (.json) files')
+    parser.add_argument('output', help='directory the sheets of each job are created in')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of jobs run at once, each in its own worker process, 0 = one per CPU (default: 1)')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                        help=f'seconds between looks into the input directory (default: {POLL_INTERVAL})')
+    parser.add_argument('--once', action='store_true',
+                        help='exit when the jobs in the input directory are finished instead of waiting for more')
+    args = parser.parse_args(argv)
+
+    input_directory = Path(args.input)
+    if not input_directory.is_dir():
+        print(f'Input directory {input_directory} not found.')
+        return 1
+    service = Service(input_directory, Path(args.output), args.jobs or os.cpu_count() or 1)
+    print(f'Watching {input_directory} for jobs.')
+    try:
+        service.serve(args.once, args.interval)
+    except KeyboardInterrupt:
+        print('Stopped.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+'''
+KylttiMaker spreadsheet input
+
+Reads field values from the first sheet of .xlsx, .xls and .csv files. Files
+are parsed once into plain value columns that are shared by all fields through
+a cache keyed by path and modification time. .xlsx files are streamed row by
+row instead of being loaded into memory as a whole. Column slices that have
+been read are also kept in compact binary files on disk, so reopening a job
+loads them through a memory map instead of parsing the workbook again.
+'''
+
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import accumulate
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from xml.etree.ElementTree import iterparse, parse
+import numpy as np
+import xlrd
+from xlrd.xlsx import cell_name_to_rowx_colx, cnv_xsd_boolean, cooked_text, error_code_from_text, get_text_from_si_or_is
+
+# Maximum amount of parsed workbooks kept in memory.
+WORKBOOK_CACHE_SIZE = 8
+# Maximum total size of the column cache files on disk (bytes).
+COLUMN_CACHE_BYTES = 256 * 1024 * 1024
+# Changed whenever the layout of column cache files changes.
+COLUMN_CACHE_MAGIC = b'KMCOLS01'
+
+SPREADSHEET_ML = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+# Values of some columns of a sheet. Columns can be shorter than the sheet (missing cells are empty).
+# Loaded are the columns that have been collected; the size is that of the whole sheet.
+@dataclass
+class Sheet:
+    columns: Dict[int, List[Any]]
+    nrows: int = 0
+    ncols: int = 0
+    loaded: Set[int] = field(default_factory=set)
+
+    # Values of a 0-based column between 0-based start row and end row (exclusive, None = no limit),
+    # the same way xlrd's col_slice() returns them.
+    def column_slice(self, column: int, start_row: int = 0, end_row: Optional[int] = None) -> List[Any]:
+        if self.nrows > 0 and column >= self.ncols:
+            raise IndexError(f'Column {column + 1} is out of range.')
+        end_row = self.nrows if end_row is None else min(end_row, self.nrows)
+        values = self.columns.get(column, [])[start_row:end_row]
+        return values + [''] * (end_row - start_row - len(values))
+
+
+# Path of the first worksheet inside an .xlsx package.
+def first_worksheet(package: zipfile.ZipFile) -> str:
+    sheet = parse(package.open('xl/workbook.xml')).find(
+        f'{SPREADSHEET_ML}sheets/{SPREADSHEET_ML}sheet')
+    relationship_id = sheet.get(f'{RELATIONSHIPS}id')
+    for relationship in parse(package.open('xl/_rels/workbook.xml.rels')).getroot():
+        if relationship.get('Id') == relationship_id:
+            target = relationship.get('Target')
+            if target.startswith('/'):
+                return target[1:]
+            return str(PurePosixPath('xl') / target)
+    raise ValueError('First worksheet not found.')
+
+
+# Shared strings table of an .xlsx package.
+def shared_strings(package: zipfile.ZipFile) -> List[str]:
+    if 'xl/sharedStrings.xml' not in package.namelist():
+        return []
+    strings = []
+    for _, element in iterparse(package.open('xl/sharedStrings.xml')):
+        if element.tag == f'{SPREADSHEET_ML}si':
+            strings.append(get_text_from_si_or_is(None, element))
+            element.clear()
+    return strings
+
+
+# Stream the rows of the first sheet of an .xlsx file as (0-based row, {0-based column: value}). Only
+# cells with a value are included and values are converted the same way xlrd converts them.
+def iter_xlsx_rows(path: Union[str, Path]) -> Iterator[Tuple[int, Dict[int, Any]]]:
+    with zipfile.ZipFile(path) as package:
+        strings = shared_strings(package)
+        row_index = -1
+        for _, element in iterparse(package.open(first_worksheet(package))):
+            if element.tag != f'{SPREADSHEET_ML}row':
+                continue
+            row_number = element.get('r')
+            row_index = int(row_number) - 1 if row_number else row_index + 1
+            column_index = -1
+            row = {}
+            for cell in element:
+                cell_name = cell.get('r')
+                column_index = cell_name_to_rowx_colx(
+                    cell_name)[1] if cell_name else column_index + 1
+                cell_type = cell.get('t', 'n')
+                value = cell.find(f'{SPREADSHEET_ML}v')
+                if cell_type == 'inlineStr':
+                    inline = cell.find(f'{SPREADSHEET_ML}is')
+                    text = get_text_from_si_or_is(
+                        None, inline) if inline is not None else value.text if value is not None else None
+                    if text:
+                        row[column_index] = text
+                elif cell_type == 'str':
+                    row[column_index] = cooked_text(
+                        None, value) if value is not None else None
+                elif cell_type == 'b':
+                    row[column_index] = cnv_xsd_boolean(
+                        value.text if value is not None else None)
+                elif cell_type == 'e':
+                    row[column_index] = error_code_from_text[value.text if value is not None else '#N/A']
+                elif value is not None and value.text:
+                    row[column_index] = strings[int(
+                        value.text)] if cell_type == 's' else float(value.text)
+            element.clear()
+            yield row_index, row
+
+
+# Stream the rows of a .csv file. Values are kept as text.
+def iter_csv_rows(path: Union[str, Path]) -> Iterator[Tuple[int, Dict[int, Any]]]:
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        try:
+            dialect = csv.Sniffer().sniff(file.read(65536), delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        file.seek(0)
+        for row_index, row in enumerate(csv.reader(file, dialect)):
+            yield row_index, {column: value for column, value in enumerate(row) if value != ''}
+
+
+# Rows of the first sheet of a .xls file.
+def iter_xls_rows(path: Union[str, Path]) -> Iterator[Tuple[int, Dict[int, Any]]]:
+    workbook = xlrd.open_workbook(str(path), on_demand=True)
+    try:
+        sheet = workbook.sheet_by_index(0)
+        for row_index in range(sheet.nrows):
+            yield row_index, {column: cell.value for column, cell in enumerate(sheet.row(row_index)) if cell.ctype != xlrd.XL_CELL_EMPTY}
+    finally:
+        workbook.release_resources()
+
+
+# Stream the rows of the first sheet of a spreadsheet file based on its extension.
+def iter_rows(path: Union[str, Path]) -> Iterator[Tuple[int, Dict[int, Any]]]:
+    suffix = Path(path).suffix.lower()
+    if suffix == '.csv':
+        return iter_csv_rows(path)
+    if suffix == '.xls':
+        return iter_xls_rows(path)
+    return iter_xlsx_rows(path)
+
+
+# Read the given 0-based columns of the first sheet of a spreadsheet file in a single pass. The size of
+# the sheet is counted from all cells, but only the values of the given columns are kept.
+def load_sheet(path: Union[str, Path], columns: Set[int]) -> Sheet:
+    sheet = Sheet({}, loaded=set(columns))
+    for row_index, row in iter_rows(path):
+        for column, value in row.items():
+            sheet.ncols = max(sheet.ncols, column + 1)
+            if column in columns:
+                values = sheet.columns.setdefault(column, [])
+                values.extend([''] * (row_index - len(values)))
+                values.append(value)
+        if row:
+            sheet.nrows = row_index + 1
+    return sheet
+
+
+# Parsed columns shared by all fields. Entries are keyed by path, modification time and size, so a file
+# changed on disk is parsed again. Only requested columns are kept: columns that are not loaded yet are
+# collected in one more pass over the file and merged into its entry. The least recently used entries
+# are dropped first.
+class WorkbookCache:
+    def __init__(self, size: int = WORKBOOK_CACHE_SIZE) -> None:
+        self.size = size
+        self.sheets = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Sheet of a file with at least the given 0-based columns loaded.
+    def get(self, path: Union[str, Path], columns: Set[int]) -> Sheet:
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            sheet = self.sheets.get(key)
+            if sheet is not None:
+                self.sheets.move_to_end(key)
+                missing = set(columns) - sheet.loaded
+                if not missing:
+                    return sheet
+            else:
+                missing = set(columns)
+        loaded = load_sheet(path, missing)
+        with self.lock:
+            sheet = self.sheets.get(key)
+            if sheet is None:
+                # Drop older versions of the same file.
+                for cached_key in [cached_key for cached_key in self.sheets if cached_key[0] == key[0]]:
+                    del self.sheets[cached_key]
+                self.sheets[key] = sheet = loaded
+            else:
+                sheet.columns.update(loaded.columns)
+                sheet.loaded |= loaded.loaded
+            while len(self.sheets) > self.size:
+                self.sheets.popitem(last=False)
+        return sheet
+
+    def clear(self) -> None:
+        with self.lock:
+            self.sheets.clear()
+
+
+WORKBOOKS = WorkbookCache()
+
+
+# Directory of the column cache: $KYLTTIMAKER_CACHE or kylttimaker in the user's cache directory.
+def cache_directory() -> Path:
+    if os.environ.get('KYLTTIMAKER_CACHE'):
+        return Path(os.environ['KYLTTIMAKER_CACHE'])
+    return Path(os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or Path.home() / '.cache') / 'kylttimaker'
+
+
+# Values of a column slice as arrays: the type of each value (0 = text, 1 = float, 2 = integer, 3 = None,
+# 4 = boolean), the numbers, the end offset of each text in the joined text, and the joined text. None if a value has
+# some other type.
+def encode_values(values: List[Any]) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray, bytes]]:
+    types = np.zeros(len(values), dtype=np.uint8)
+    numbers = np.zeros(len(values), dtype=np.float64)
+    texts = []
+    for index, value in enumerate(values):
+        if isinstance(value, str):
+            texts.append(value)
+            continue
+        texts.append('')
+        if isinstance(value, float):
+            types[index] = 1
+        elif isinstance(value, bool):
+            types[index] = 4
+        elif isinstance(value, int) and abs(value) < 2 ** 53:
+            types[index] = 2
+        elif value is None:
+            types[index] = 3
+            continue
+        else:
+            return None
+        numbers[index] = value
+    offsets = np.array(list(accumulate(map(len, texts), initial=0)), dtype=np.int64)
+    return types, numbers, offsets, ''.join(texts).encode('utf-8', 'surrogatepass')
+
+
+# Conversions of stored numbers back into values by value type (text is taken from the joined text).
+VALUE_TYPES = (None, float, int, lambda number: None, bool)
+
+
+# Start of the next 8 byte aligned section of a cache file.
+def aligned(position: int) -> int:
+    return -(-position // 8) * 8
+
+
+# Parsed column slices kept in files on disk between runs. A file holds one slice (path, column and rows)
+# together with the size and modification time of the spreadsheet it was read from: a changed
+# spreadsheet no longer matches and the slice is read again and overwritten. Values are stored as
+# arrays, loaded through a memory map. The least recently used files are removed once the files take
+# more than the maximum size. Failing to use the cache directory only means parsing again.
+#
+# File layout: magic, header length, JSON header, then 8 byte aligned sections of value types, numbers,
+# text offsets (in characters) and the joined UTF-8 text.
+class ColumnCache:
+    def __init__(self, directory: Optional[Path] = None, max_bytes: int = COLUMN_CACHE_BYTES) -> None:
+        self.directory = directory or cache_directory()
+        self.max_bytes = max_bytes
+
+    def entry_path(self, slice_key: Tuple[str, int, int, Optional[int]]) -> Path:
+        return self.directory / (hashlib.sha256(repr(slice_key).encode()).hexdigest()[:32] + '.col')
+
+    # Values stored for the given source, or None if there is no entry or it is stale or unreadable.
+    def load(self, entry: Path, source: Dict[str, Any]) -> Optional[List[Any]]:
+        try:
+            with open(entry, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:8] != COLUMN_CACHE_MAGIC:
+                    return None
+                header_length, = struct.unpack_from('<q', data, 8)
+                header = json.loads(data[16:16 + header_length])
+                if header['source'] != source:
+                    return None
+                count = header['count']
+                position = aligned(16 + header_length)
+                types = np.frombuffer(data, np.uint8, count, position).copy()
+                position = aligned(position + count)
+                numbers = np.frombuffer(data, np.float64, count, position).tolist()
+                position += 8 * count
+                offsets = np.frombuffer(data, np.int64, count + 1, position).tolist()
+                position += 8 * (count + 1)
+                text = data[position:position + header['text_bytes']].decode('utf-8', 'surrogatepass')
+            os.utime(entry)
+        except (OSError, ValueError, KeyError, TypeError, struct.error):
+            return None
+        values = [text[start:end] for start, end in zip(offsets, offsets[1:])]
+        for index in np.flatnonzero(types).tolist():
+            values[index] = VALUE_TYPES[types[index]](numbers[index])
+        return values
+
+    def store(self, entry: Path, source: Dict[str, Any], values: List[Any]) -> None:
+        encoded = encode_values(values)
+        if encoded is None:
+            return
+        types, numbers, offsets, text = encoded
+        header = json.dumps({'source': source, 'count': len(values), 'text_bytes': len(text)}).encode()
+        sections = [COLUMN_CACHE_MAGIC + struct.pack('<q', len(header)) + header, types.tobytes(),
+                    numbers.tobytes() + offsets.tobytes() + text]
+        temporary_path = entry.with_name(f'{entry.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(temporary_path, 'wb') as file:
+                for section in sections:
+                    file.write(section)
+                    file.write(bytes(aligned(file.tell()) - file.tell()))
+            os.replace(temporary_path, entry)
+            self.prune()
+        except OSError:
+            if temporary_path.exists():
+                temporary_path.unlink()
+
+    # Remove the least recently used files until the rest fit in the maximum size.
+    def prune(self) -> None:
+        entries = []
+        for entry in self.directory.glob('*.col'):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                entry.unlink()
+            except OSError:
+                continue
+            total -= size
+
+    # Values of a column slice (0-based column and rows) of a spreadsheet file, from the cache if it is
+    # still up to date and otherwise from read(), whose result is then stored.
+    def get(self, path: Union[str, Path], column: int, start_row: int, end_row: Optional[int], read: Callable[[], List[Any]]) -> List[Any]:
+        path = Path(path).resolve()
+        stat = path.stat()
+        source = {'path': str(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                  'column': column, 'start_row': start_row, 'end_row': end_row}
+        entry = self.entry_path((str(path), column, start_row, end_row))
+        values = self.load(entry, source)
+        if values is None:
+            values = read()
+            # Only store values that are known to come from the stated version of the file.
+            stat = path.stat()
+            if (stat.st_size, stat.st_mtime_ns) == (source['size'], source['mtime_ns']):
+                self.store(entry, source, values)
+        return values
+
+    def clear(self) -> None:
+        for entry in self.directory.glob('*.col'):
+            entry.unlink()
+
+
+COLUMNS = ColumnCache()
+
+
+# Read column slices of the first sheet of a spreadsheet file as (column, start row, end row). Columns and
+# rows are 1-based and end row 0 means no limit. Slices are kept in the column cache on disk unless disk
+# cache is False; the slices that are not cached are all read in a single pass over the file.
+def read_columns(path: Union[str, Path], slices: Sequence[Tuple[int, int, int]], disk_cache: bool = True) -> List[List[Any]]:
+    normalized = []
+    for column, start_row, end_row in slices:
+        assert column > 0, 'Column must be greater than 0.'
+        assert start_row > 0, 'Start row must be greater than 0.'
+        if end_row == 0:  # End row 0 = no limit.
+            end_row = None
+        else:
+            assert end_row >= start_row, 'End row must be greater than or equal to start row.'
+        normalized.append((column - 1, start_row - 1, end_row))
+    columns = {column for column, _, _ in normalized}
+
+    def reader(column: int, start_row: int, end_row: Optional[int]) -> Callable[[], List[Any]]:
+        return lambda: WORKBOOKS.get(path, columns).column_slice(column, start_row, end_row)
+    if not disk_cache:
+        return [reader(*normalized_slice)() for normalized_slice in normalized]
+    return [COLUMNS.get(path, *normalized_slice, reader(*normalized_slice)) for normalized_slice in normalized]
+
+
+# Read a single column slice, see read_columns().
+def read_column(path: Union[str, Path], column: int, start_row: int = 1, end_row: int = 0, disk_cache: bool = True) -> List[Any]:
+    return read_columns(path, [(column, start_row, end_row)], disk_cache)[0]
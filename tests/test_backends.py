@@ -0,0 +1,50 @@
+'''
+Both output backends must write the same sheet. Each sheet is made in a fresh
+process, because ezdxf keeps some state (such as the entity types it has seen)
+per process, and a sheet must not depend on what the process did before. The
+hash seed is fixed because ezdxf writes its CLASSES section in set order.
+'''
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from engine import DXF_VERSIONS
+
+ROOT = Path(__file__).resolve().parent.parent
+# Header variables that change on every save.
+VOLATILE_HEADER = {'$TDCREATE', '$TDUCREATE', '$TDUPDATE', '$TDUUPDATE', '$TDINDWG', '$TDUSRTIMER', '$FINGERPRINTGUID', '$VERSIONGUID'}
+SCRIPT = '''
+import sys
+from engine import FieldSpec, HoleSpec, Job, Layout, QRSpec, TextSpec, generate
+job = Job(Layout(layers_per_sheet=1), (FieldSpec(['A1', 'B22', 'C333', 'D4444'], (
+    QRSpec(inverse=True, padding=1.0), TextSpec(position_x=75.0, size=5.0), HoleSpec(position_x=140.0, position_y=11.0, diameter=4.0))),),
+    sys.argv[1], backend=sys.argv[2])
+generate(job, sys.argv[3])
+'''
+
+
+# Tag pairs of a DXF file without the values of the volatile header variables.
+def dxf_tags(path: Path) -> list:
+    lines = path.read_text(encoding='utf-8').splitlines()
+    tags = list(zip(lines[::2], lines[1::2]))
+    result = []
+    skip = False
+    for code, value in tags:
+        if code.strip() == '9':
+            skip = value in VOLATILE_HEADER
+        elif skip:
+            continue
+        result.append((code.strip(), value))
+    return result
+
+
+@pytest.mark.parametrize('dxf_version', DXF_VERSIONS)
+def test_backends_write_same_content_in_fresh_processes(dxf_version: str, tmp_path: Path) -> None:
+    paths = {}
+    environment = dict(os.environ, PYTHONHASHSEED='0')
+    for backend in ('EZDXF', 'DIRECT'):
+        paths[backend] = tmp_path / f'{backend}.dxf'
+        subprocess.run([sys.executable, '-c', SCRIPT, dxf_version, backend, str(paths[backend])], cwd=ROOT, env=environment, check=True)
+    assert dxf_tags(paths['EZDXF']) == dxf_tags(paths['DIRECT'])
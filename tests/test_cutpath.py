@@ -0,0 +1,59 @@
+'''
+The cut order may only change where the laser head travels between cuts: every
+cut is still made exactly once, and 2-opt never makes the nearest-neighbour
+travel longer.
+'''
+
+import math
+import random
+from typing import List
+import pytest
+from cutpath import Cut, nearest_neighbour, order_cuts, travel_length, two_opt
+
+
+# Lines in random directions and holes scattered over a sheet.
+def random_cuts(seed: int, count: int) -> List[Cut]:
+    generator = random.Random(seed)
+    cuts = []
+    for index in range(count):
+        x, y = generator.uniform(0, 1000), generator.uniform(0, 600)
+        if index % 4 == 0:
+            cuts.append(Cut((x, y), (x, y), 2 * math.pi * 2.0, 'CIRCLE', ((x, y), 2.0), {'index': index}))
+        else:
+            end = (x + generator.uniform(-80, 80), y + generator.uniform(-80, 80))
+            cuts.append(Cut((x, y), end, math.dist((x, y), end), 'POLYLINE', [(x, y), end], {'index': index}))
+    return cuts
+
+
+# Every cut of the original appears once in the tour, in either direction.
+def assert_same_cuts(cuts: List[Cut], tour: List[Cut]) -> None:
+    assert sorted(cut.dxfattribs['index'] for cut in tour) == list(range(len(cuts)))
+    for cut in tour:
+        original = cuts[cut.dxfattribs['index']]
+        assert (cut.start, cut.end) in ((original.start, original.end), (original.end, original.start))
+        if cut.kind == 'POLYLINE':
+            assert [cut.start, cut.end] == [tuple(point) for point in cut.geometry]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_two_opt_never_longer_than_nearest_neighbour(seed: int) -> None:
+    cuts = random_cuts(seed, 300)
+    origin = (0.0, 0.0)
+    greedy = nearest_neighbour(cuts, origin)
+    improved = two_opt(greedy, origin)
+    assert_same_cuts(cuts, greedy)
+    assert_same_cuts(cuts, improved)
+    assert travel_length(improved, origin) <= travel_length(greedy, origin) + 1e-9
+    assert travel_length(order_cuts(cuts, origin), origin) == pytest.approx(travel_length(improved, origin))
+
+
+def test_nearest_neighbour_picks_closest_end() -> None:
+    cuts = [Cut((10.0, 0.0), (20.0, 0.0), 10.0, 'POLYLINE', [(10.0, 0.0), (20.0, 0.0)], {'index': 0}),
+            Cut((50.0, 0.0), (21.0, 0.0), 29.0, 'POLYLINE', [(50.0, 0.0), (21.0, 0.0)], {'index': 1})]
+    tour = nearest_neighbour(cuts)
+    assert [(cut.start, cut.end) for cut in tour] == [((10.0, 0.0), (20.0, 0.0)), ((21.0, 0.0), (50.0, 0.0))]
+    assert travel_length(tour) == pytest.approx(11.0)
+
+
+def test_empty() -> None:
+    assert order_cuts([]) == []
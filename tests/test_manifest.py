@@ -0,0 +1,99 @@
+'''
+Sheet hashes decide which sheets incremental runs redraw and whether a shard
+matches the job manifest, so they must depend on what is drawn only: not on
+the working directory or the path the job file was given with, but on the
+content of the font files.
+'''
+
+import json
+from pathlib import Path
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from engine import check_job_manifest, generate, load_job
+from metrics import Metrics
+
+CHARACTERS = 'ABCDEFGHIJ0123456789-'
+
+
+# Font file whose glyphs are squares of the given size, so fonts with different sizes draw differently.
+def write_font(path: Path, size: int) -> None:
+    names = ['.notdef'] + [f'glyph{ord(character)}' for character in CHARACTERS]
+    builder = FontBuilder(1000, isTTF=True)
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap({ord(character): f'glyph{ord(character)}' for character in CHARACTERS})
+    glyphs = {}
+    for name in names:
+        pen = TTGlyphPen(None)
+        pen.moveTo((50, 0))
+        pen.lineTo((50, size))
+        pen.lineTo((50 + size, size))
+        pen.lineTo((50 + size, 0))
+        pen.closePath()
+        glyphs[name] = pen.glyph()
+    builder.setupGlyf(glyphs)
+    builder.setupHorizontalMetrics({name: (size + 100, 50) for name in names})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupOS2(sCapHeight=700)
+    builder.setupNameTable({'familyName': 'Squares', 'styleName': 'Regular'})
+    builder.setupPost()
+    builder.save(str(path))
+
+
+# Job with a text field drawn with a font next to the job file, on three sheets.
+@pytest.fixture
+def job_path(tmp_path: Path) -> Path:
+    directory = tmp_path / 'job'
+    directory.mkdir()
+    write_font(directory / 'font.ttf', 600)
+    description = {
+        'sheet': {'width': 300, 'height': 100, 'layers': 1},
+        'sign': {'width': 150, 'height': 25},
+        'fields': [{'values': [f'AB-{index:04}' for index in range(20)],
+                    'marks': [{'type': 'Text', 'size': 5, 'font': 'font.ttf'}]}]
+    }
+    with open(directory / 'job.json', 'w', encoding='utf-8') as file:
+        json.dump(description, file)
+    return directory / 'job.json'
+
+
+# Run a job incrementally and return the number of sheets that were left unchanged.
+def unchanged_sheets(job: Path, output: Path) -> int:
+    metrics = Metrics()
+    generate(load_job(job), output, metrics=metrics, incremental=True)
+    return metrics.counts['unchanged sheets']
+
+
+def test_sheets_unchanged_from_another_directory(job_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    output = tmp_path / 'out'
+    output.mkdir()
+    monkeypatch.chdir(job_path.parent)
+    assert unchanged_sheets(Path('job.json'), output) == 0
+    sheets = sorted(output.glob('*.dxf'))
+    assert len(sheets) == 3
+    modified = [sheet.stat().st_mtime_ns for sheet in sheets]
+    monkeypatch.chdir(tmp_path)
+    assert unchanged_sheets(job_path, output) == 3
+    assert unchanged_sheets(Path('job') / 'job.json', output) == 3
+    assert [sheet.stat().st_mtime_ns for sheet in sheets] == modified
+
+
+def test_replaced_font_redraws_sheets(job_path: Path, tmp_path: Path) -> None:
+    output = tmp_path / 'out'
+    output.mkdir()
+    assert unchanged_sheets(job_path, output) == 0
+    write_font(job_path.parent / 'font.ttf', 500)
+    assert unchanged_sheets(job_path, output) == 0
+
+
+def test_job_manifest_matches_from_another_directory(job_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    manifest = tmp_path / 'job_manifest.json'
+    monkeypatch.chdir(job_path.parent)
+    check_job_manifest(load_job('job.json'), manifest)
+    monkeypatch.chdir(tmp_path)
+    check_job_manifest(load_job(job_path), manifest)
+    description = json.loads(job_path.read_text(encoding='utf-8'))
+    description['fields'][0]['values'][17] = 'CHANGED'
+    job_path.write_text(json.dumps(description), encoding='utf-8')
+    with pytest.raises(AssertionError, match=r'values of sheet2\.dxf have changed'):
+        check_job_manifest(load_job(job_path), manifest)
@@ -0,0 +1,76 @@
+'''
+Nested signs are cut out of the sheet as placed, so every sign must be placed
+once, inside the sheet and without overlapping another sign, and the cut lines
+must follow exactly the outlines of the signs.
+'''
+
+import random
+from itertools import combinations
+from typing import List, Set, Tuple
+import pytest
+from nesting import EPSILON, Placement, cut_lines, nest
+
+SHEET_WIDTH = 300.0
+SHEET_HEIGHT = 200.0
+
+
+# Sign sizes in whole units, so all placements and cut lines fall on a grid of whole units.
+def random_sizes(seed: int, count: int) -> List[Tuple[float, float]]:
+    generator = random.Random(seed)
+    return [(float(generator.randint(10, 150)), float(generator.randint(5, 90))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('rotate', (False, True))
+@pytest.mark.parametrize('seed', range(5))
+def test_placements_inside_sheet_without_overlap(rotate: bool, seed: int) -> None:
+    sizes = random_sizes(seed, 120)
+    plan = nest(sizes, SHEET_WIDTH, SHEET_HEIGHT, rotate)
+    placed = sorted(placement.sign_index for layer in plan.layers for placement in layer)
+    assert placed == list(range(len(sizes)))
+    for layer in plan.layers:
+        for placement in layer:
+            width, height = sizes[placement.sign_index]
+            assert (placement.width, placement.height) == ((height, width) if placement.rotated else (width, height))
+            assert rotate or not placement.rotated
+            assert placement.x >= -EPSILON and placement.x + placement.width <= SHEET_WIDTH + EPSILON
+            assert placement.y >= -EPSILON and placement.y + placement.height <= SHEET_HEIGHT + EPSILON
+        for first, second in combinations(layer, 2):
+            overlap_x = min(first.x + first.width, second.x + second.width) - max(first.x, second.x)
+            overlap_y = min(first.y + first.height, second.y + second.height) - max(first.y, second.y)
+            assert overlap_x <= EPSILON or overlap_y <= EPSILON, (first, second)
+
+
+def test_sign_too_large_for_sheet() -> None:
+    with pytest.raises(AssertionError):
+        nest([(250.0, 250.0)], SHEET_WIDTH, SHEET_HEIGHT)
+    plan = nest([(150.0, 250.0)], SHEET_WIDTH, SHEET_HEIGHT, rotate=True)
+    assert plan.layers[0][0].rotated
+
+
+# Unit segments ((x0, y0), (x1, y1)) of the outlines of the placements.
+def outline_units(placements: Tuple[Placement, ...]) -> Set[Tuple[Tuple[int, int], Tuple[int, int]]]:
+    units = set()
+    for placement in placements:
+        left, top = int(placement.x), int(placement.y)
+        right, bottom = left + int(placement.width), top + int(placement.height)
+        for y in (top, bottom):
+            units.update(((x, y), (x + 1, y)) for x in range(left, right))
+        for x in (left, right):
+            units.update(((x, y), (x, y + 1)) for y in range(top, bottom))
+    return units
+
+
+@pytest.mark.parametrize('rotate', (False, True))
+def test_cut_lines_cover_outlines_once(rotate: bool) -> None:
+    plan = nest(random_sizes(7, 80), SHEET_WIDTH, SHEET_HEIGHT, rotate)
+    for layer in plan.layers:
+        units = []
+        for (x0, y0), (x1, y1) in cut_lines(layer):
+            assert x0 == x1 or y0 == y1
+            if y0 == y1:
+                units.extend(((x, int(y0)), (x + 1, int(y0))) for x in range(int(x0), int(x1)))
+            else:
+                units.extend(((int(x0), y), (int(x0), y + 1)) for y in range(int(y0), int(y1)))
+        # Every outline is cut and nothing else, each stretch only once.
+        assert len(units) == len(set(units))
+        assert set(units) == outline_units(layer)
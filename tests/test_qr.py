@@ -0,0 +1,85 @@
+'''
+The QR code matrices are built with NumPy on top of pyqrcode's internals, so
+they are compared with what pyqrcode itself builds. The merged hatch
+geometries must cover exactly the dark modules of the matrix.
+'''
+
+import random
+import string
+import numpy as np
+import pyqrcode
+import pytest
+from engine import Column, QRSpec, encode_column, qr_matrix, qr_paths
+
+# Values of every mode (numeric, alphanumeric, binary and kanji) and of many versions.
+VALUES = ['0', '1234567890', 'HELLO WORLD', 'PART-00042', 'hello, world', 'äöå ÄÖÅ', '漢字', '点茗',
+          'x' * 200, '9' * 600, 'A' * 400, '']
+random.seed(6)
+VALUES += [''.join(random.choice(characters) for _ in range(random.randint(1, 120)))
+           for characters in (string.digits, string.ascii_uppercase + ' $%*+-./:', string.printable.strip())
+           for _ in range(15)]
+
+
+def pyqrcode_matrix(value: str, error: str) -> np.ndarray:
+    text = pyqrcode.create(value, error=error).text(quiet_zone=0)
+    return np.array([[module == '1' for module in row] for row in text.split()], dtype=bool)
+
+
+@pytest.mark.parametrize('error', QRSpec.ERROR_OPTIONS)
+def test_matrix_matches_pyqrcode(error: str) -> None:
+    for value in VALUES:
+        assert np.array_equal(qr_matrix(value, error), pyqrcode_matrix(value, error)), value
+
+
+def test_encode_column_matches_single_values() -> None:
+    values = VALUES[:10] * 3
+    for value, matrix in zip(values, encode_column(values, 'M', 'RUNS')):
+        assert matrix is qr_matrix(value, 'M')
+
+
+# Modules whose centers are inside the paths with the even-odd rule, by casting a ray to the right from
+# each center and counting the vertical edges it crosses.
+def filled_modules(modules: int, vertices: np.ndarray, ends: tuple) -> np.ndarray:
+    crossings = np.zeros((modules, modules), dtype=int)
+    centers = np.arange(modules) + 0.5
+    start = 0
+    for end in ends:
+        path = vertices[start:end]
+        for (x0, y0), (x1, y1) in zip(path, np.roll(path, -1, axis=0)):
+            if x0 == x1:
+                rows = (centers > min(y0, y1)) & (centers < max(y0, y1))
+                crossings[np.ix_(rows, centers < x0)] += 1
+        start = end
+    return crossings % 2 == 1
+
+
+@pytest.mark.parametrize('geometry', QRSpec.GEOMETRY_OPTIONS)
+def test_geometry_covers_dark_modules(geometry: str) -> None:
+    for value in VALUES[:20]:
+        matrix = qr_matrix(value, 'H')
+        modules, vertices, ends = qr_paths(value, 'H', geometry)
+        assert modules == len(matrix)
+        assert np.array_equal(filled_modules(modules, vertices, ends), matrix), value
+
+
+@pytest.mark.parametrize('geometry', ('RUNS', 'RECTANGLES'))
+def test_merged_rectangles_do_not_overlap(geometry: str) -> None:
+    for value in VALUES[:20]:
+        matrix = qr_matrix(value, 'H')
+        _, vertices, _ = qr_paths(value, 'H', geometry)
+        corners = vertices.reshape(-1, 4, 2)
+        area = ((corners[:, 2, 0] - corners[:, 0, 0]) * (corners[:, 2, 1] - corners[:, 0, 1])).sum()
+        assert area == matrix.sum()
+        assert len(corners) <= len(qr_paths(value, 'H', 'MODULES')[2])
+
+
+def test_check_reports_small_modules() -> None:
+    # Versions 1, 10 and 40 at error correction level L, 21, 57 and 177 modules across 20 units.
+    values = Column(['1', '9' * 652, '9' * 7089])
+    spec = QRSpec(size=20, padding=0, error='L', min_module=0.2)
+    problems = dict(spec.check(values, np.full(3, 100.0), np.full(3, 100.0)))
+    assert problems['QR code modules are smaller than 0.2'].tolist() == [False, False, True]
+    # Padding leaves 12 units, 0.21 per module at version 10.
+    spec = QRSpec(size=20, padding=4, error='L', min_module=0.25)
+    problems = dict(spec.check(values, np.full(3, 100.0), np.full(3, 100.0)))
+    assert problems['QR code modules are smaller than 0.25'].tolist() == [False, True, True]